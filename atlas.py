@@ -0,0 +1,89 @@
+# gera o atlas de sprites usado pelo cliente
+# executar antes de jogar: python atlas.py [largura da janela]
+# todos os sprites são renderizados uma vez numa única imagem + índice, assim o cliente
+# não precisa procurar fontes no sistema ao iniciar nem a cada texto do menu
+
+import json
+import os
+import string
+import sys
+import pygame
+from server import Server
+from util import render_sprite, sprite_key
+from views import ship_sprite_args, bullet_sprite_args, asteroid_sprite_args
+
+ATLAS_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "atlas.png")
+ATLAS_INDEX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "atlas.json")
+ATLAS_WIDTH = 2048
+PADDING = 1
+
+# textos fixos do menu (client.py) e o divisor da largura da janela usado como tamanho da fonte
+MENU_TEXTS = [
+    ("Asteroids", 9),
+    ("1 -> Criar sessão", 27),
+    ("2 -> Se juntar a uma sessão", 27),
+    ("3 -> Assistir uma sessão", 27),
+    ("Quantidade de players: ", 27),
+    ("(Enter para confirmar)", 54),
+    ("Aguardando jogadores...", 27),
+    ("Conectados: ", 27),
+    ("Jogadores conectados!", 27),
+    ("[Espaço] para inciar...", 27),
+    ("Prontos: ", 27),
+    ("Endereço IP:Porta (ex 127.0.0.1:5000) ", 27),
+]
+# caracteres digitados pelo usuário e das estatísticas (F3), textos variáveis são montados a partir deles
+INPUT_GLYPHS = [(string.digits + "/", 27), (string.ascii_letters + string.digits + ".:-_", 20), (string.ascii_letters + string.digits + " .:/", 54)]
+MENU_FONT = "sourcecodepro"
+
+# lista de argumentos de util.load_sprite para todos os sprites conhecidos do jogo
+def sprite_specs(width):
+    colors = [*Server.COLORS, (100,100,100)]
+    specs = []
+    for color in colors:
+        specs.append(ship_sprite_args(color))
+        specs.append(bullet_sprite_args(color))
+    for size in (3, 2, 1):
+        specs.append(asteroid_sprite_args(size))
+    for text, divisor in MENU_TEXTS:
+        specs.append((text, width/divisor, MENU_FONT))
+    for glyphs, divisor in INPUT_GLYPHS:
+        for glyph in glyphs:
+            specs.append((glyph, width/divisor, MENU_FONT))
+    return specs
+
+# empacota os sprites em prateleiras, do mais alto para o mais baixo
+def pack(sprites):
+    rects = {}
+    x, y, shelf_height = 0, 0, 0
+    for key, sprite in sorted(sprites.items(), key=lambda item: -item[1].get_height()):
+        w, h = sprite.get_size()
+        if x + w > ATLAS_WIDTH:
+            x, y, shelf_height = 0, y + shelf_height + PADDING, 0
+        rects[key] = (x, y, w, h)
+        x += w + PADDING
+        shelf_height = max(shelf_height, h)
+    return rects, y + shelf_height
+
+def build_atlas(width):
+    pygame.init()
+    sprites = {}
+    for spec in sprite_specs(width):
+        sprites[sprite_key(*spec)] = render_sprite(*spec)
+    rects, height = pack(sprites)
+
+    atlas = pygame.Surface((ATLAS_WIDTH, height), pygame.SRCALPHA)
+    atlas.fill((0, 0, 0, 0))
+    index = {"width": width, "sprites": []}
+    for key, sprite in sprites.items():
+        atlas.blit(sprite, rects[key][:2])
+        index["sprites"].append({"key": list(key), "rect": list(rects[key])})
+
+    os.makedirs(os.path.dirname(ATLAS_IMAGE), exist_ok=True)
+    pygame.image.save(atlas, ATLAS_IMAGE)
+    with open(ATLAS_INDEX, "w") as index_file:
+        json.dump(index, index_file)
+    print("Atlas: "+str(len(sprites))+" sprites salvos em "+ATLAS_IMAGE)
+
+if __name__ == "__main__":
+    build_atlas(int(sys.argv[1]) if len(sys.argv) > 1 else 972)
@@ -2,21 +2,31 @@
 # modificado para suportar diversos players e online
 
 import ast
-import pickle
+import select
 import socket
 from threading import Lock, Thread
 import time
 import pygame
 from pygame.math import Vector2
-from models import Spaceship, Asteroid, Bullet, ServerData, ClientData
+from models import GameObject, Spaceship, Bullet, AsteroidState, ShipState, BulletState, ServerData, ClientData, MessageReader
+from views import SpriteViews
+from governor import FrameGovernor
 from server import Server
-from util import load_sprite
+from util import load_sprite, render_text, load_atlas, asteroid_checksum, send_message
+from atlas import ATLAS_IMAGE, ATLAS_INDEX
 
 
 class Client:
-    def __init__(self, size: Vector2, tick_rate = 120, ip_address = "localhost", lag = 0, port = 5000, difficulty = 1):
+    RECONNECT_ATTEMPTS = 5 # tentativas de voltar para a partida quando a conexão cai
+    RECONNECT_DELAY = 1 # segundos entre as tentativas
+    MAX_FRAME_TIME = 0.1 # frames mais longos (ex: janela arrastada) não fazem a nave saltar
+
+    def __init__(self, size: Vector2, tick_rate = 120, ip_address = "localhost", lag = 0, port = 5000, difficulty = 1, sim_rate = 60, snapshot_rate = 30):
         self.size = Vector2(size) # tamanho da tela, deve ser mesmo do server
-        self.tick_rate = tick_rate # tempo de processamento do jogo, deve ser mesmo do server
+        self.tick_rate = tick_rate # fps do cliente
+        self.sim_rate = sim_rate # ticks por segundo da simulação, no caso desse cliente criar um servidor
+        self.snapshot_rate = snapshot_rate # snapshots por segundo enviados pelo servidor, caso esse cliente crie um
+        self.server_tick_rate = sim_rate # taxa da simulação do servidor conectado, recebida no handshake
         self.lag = lag # lag artificial, no caso desse cliente criar um servidor
         self.port = port # porta que o servidor é criado, caso esse cliente crie um
         self.ip_address = ip_address # ip a criar servidor, caso esse cliente crie um
@@ -24,17 +34,46 @@ class Client:
         pygame.init()
         pygame.display.set_caption("Asteroids")
         self.screen = pygame.display.set_mode(size)  # 972 x 756
+        # sprites pré-renderizados por atlas.py, sem ele os sprites são renderizados com as fontes do sistema
+        if not load_atlas(ATLAS_IMAGE, ATLAS_INDEX):
+            print("Atlas de sprites não encontrado, execute python atlas.py para gerá-lo")
         self.clock = pygame.time.Clock()
         self.started = False
         self.lock = Lock() # lock para resolver race conditions entre o cliente e a thread de seu listener
+        self.views = SpriteViews() # sprites e caches de rotação, separados do estado das entidades
+        self.governor = FrameGovernor(tick_rate) # reduz a qualidade quando os frames estouram o orçamento
+        self.show_stats = False # estatísticas de desempenho na tela, alternadas com F3
+        self.stats_surface = None
+        self.stats_time = 0
+        self.host = None # servidor criado por esse cliente, caso ele tenha criado a sessão
+        self.frame_scale = 1 # duração do último frame em frames de referência, escala o movimento local
+        self.last_frame = None
         self._mainMenu()
 
     # loop para execução do jogo
     def _loop(self):
         while True:
+            start = time.perf_counter()
+            # o movimento segue o tempo real entre frames, assim o governor muda só o que é desenhado,
+            # não a velocidade do jogo
+            if self.last_frame is not None:
+                self.frame_scale = min(start - self.last_frame, self.MAX_FRAME_TIME) * GameObject.REFERENCE_RATE
+            self.last_frame = start
             self._input()
             self._game()
-            self._draw()
+            if self.governor.should_render():
+                self._draw()
+            # o tempo medido é só o trabalho do frame, sem a espera do clock
+            if self.governor.record(time.perf_counter() - start):
+                self._apply_quality()
+            self.clock.tick(self.tick_rate)
+
+    # aplica o nível de qualidade escolhido pelo governor aos sprites
+    def _apply_quality(self):
+        settings = self.governor.settings
+        self.views.rotation_step = settings["rotation_step"]
+        self.views.smooth = settings["smooth"]
+        print("Cliente: qualidade ajustada para o nível "+str(self.governor.level))
 
 
     # limpa dados do jogo, referente a esse usuário
@@ -43,6 +82,12 @@ class Client:
         self.team = []  # naves de outros players
         self.team_bullets = [] # balas de outros players
         self.asteroids = []
+        self.server_tick = 0 # último tick recebido do servidor
+        self.server_tick_time = None # momento em que o último tick foi recebido
+        self.resync = False # checksum dos asteroides não bateu, pede estado completo ao servidor
+        self.new_shots = [] # balas disparadas ainda não enviadas ao servidor
+        self.hit_claims = [] # acertos ainda não enviados ao servidor
+        self.game_over_tick = None # colisão da nave ainda não enviada ao servidor
 
     # inicia o jogo
     def _start_game(self):
@@ -55,30 +100,49 @@ class Client:
         self._loop()
 
     # cliente cuida apenas da lógica da nave e das balas do jogador.
-    # Importante notar que o jogo parte do princípio que o cliente não irá trapacear,
-    # existe a possibilidade de "mentir" para o servidor que o jogador acertou uma bala ou que não foi atingido por um asteroide
+    # Acertos e colisões são apenas pedidos, o servidor os valida com seu histórico de estados.
+    # Ainda existe a possibilidade de "mentir" para o servidor que não foi atingido por um asteroide
     def _game(self):
         self.lock.acquire()
+        # asteroides são simulados localmente a partir do tick estimado do servidor
+        tick = self._current_tick()
+        for asteroid in self.asteroids:
+            asteroid.move(self.size, tick)
+        # balas do jogador também seguem o tick do server, com a mesma fórmula que o server usa para validar os acertos
+        for bullet in self.bullets:
+            bullet.move_to(tick, GameObject.REFERENCE_RATE / self.server_tick_rate)
         for game_object in self._get_game_objects():
-            game_object.move(self.screen.get_size())
-        game_over = False
+            if not isinstance(game_object, (AsteroidState, Bullet)):
+                game_object.move(self.screen.get_size(), self.frame_scale)
+
+        # espectador não tem nave, só avisa o servidor caso os asteroides dessincronizem
+        if self.spaceship is None:
+            resync = self.resync
+            self.resync = False
+            self.lock.release()
+            if resync:
+                self._send(self.connection, "resync")
+            return
+
+        game_over_tick = None
 
         # Se a nave colide com um asteroide, o jogador morre.
         # A posição do asteroide a ser considerada pelo evento é a posição que o cliente vê.
-        # Desse jeito, num cenário de alta latência, o jogador não vai morrer por conta de um asteroide que não estava em sua tela
+        # Desse jeito, num cenário de alta latência, o jogador não vai morrer por conta de um asteroide que não estava em sua tela.
+        # O servidor confere a colisão voltando os asteroides para o tick informado
         for asteroid in self.asteroids:
             if self.spaceship.collides_with(asteroid):
-                game_over = True
+                game_over_tick = tick
                 break
 
         # Se a bala colide com um asteroide, o asteroide é destruído (ou dividido)
         # Assim como acima, a posição a ser considerada é a que o cliente vê.
-        # Dessa forma, o cliente informa ao servidor quando atingiu um asteroide, e este divide asteroide.
-        hit_asteroids = []
+        # Dessa forma, o cliente informa ao servidor a bala, o asteroide e o tick do acerto, e este valida e divide o asteroide.
+        hit_claims = []
         for bullet in self.bullets[:]:
             for asteroid_index in range(len(self.asteroids)):
                 if self.asteroids[asteroid_index].collides_with(bullet):
-                    hit_asteroids.append(self.asteroids[asteroid_index].id)
+                    hit_claims.append([bullet.id, self.asteroids[asteroid_index].id, tick])
                     #del self.asteroids[asteroid_index]
                     self.bullets.remove(bullet)
                     break
@@ -88,63 +152,101 @@ class Client:
             if not self.screen.get_rect().collidepoint(bullet.position):
                 self.bullets.remove(bullet)
 
+        # acertos e colisões se acumulam nos frames em que o governor não envia dados
+        self.hit_claims.extend(hit_claims)
+        if self.game_over_tick is None:
+            self.game_over_tick = game_over_tick
+        if not self.governor.should_send():
+            self.lock.release()
+            return
+
         # envia dados do cliente para o servidor
-        client_data = ClientData(self.spaceship, self.bullets, hit_asteroids, game_over)
+        client_data = ClientData(self.spaceship, self.new_shots, self.hit_claims, self.game_over_tick, self.server_tick, self.resync)
+        self.new_shots = []
+        self.hit_claims = []
+        self.game_over_tick = None
+        self.resync = False
         self.lock.release()
-        self.connection.send(pickle.dumps(client_data))
+        self._send(self.connection, client_data)
+
+    # envios do jogo ignoram a conexão caída, o listener cuida da reconexão
+    def _send(self, connection, message):
+        try:
+            send_message(connection, message)
+        except OSError:
+            pass
 
     # listener que recebe dados do servidor
     def _server_listener(self):
 
         # executa enquanto o cliente estiver conectado
         while self.connected:
-            self.clock.tick(self.tick_rate)
             try:
-                recv = self.connection.recv(2048)
-                load = pickle.loads(recv)
-                spaceships, bullets, sv_asteroids = self._unpack_server_data(load)
+                load = self.reader.poll()
+                if load is None:
+                    continue
+                spaceships, bullets = self._unpack_server_data(load)
                 self.lock.acquire()
                 self.team_bullets = bullets
                 self.team = spaceships
+                self.server_tick = load.tick
+                self.server_tick_time = time.monotonic()
+                self._apply_asteroid_events(load.asteroid_events)
 
-                ## algoritmo muito lento (30ms com n=20)
-                ## não precisa reinstanciar asteroides que já existem no cliente
-                # asteroids = []
-                # for sv_asteroid in sv_asteroids:
-                #     new = Asteroid(sv_asteroid[1], sv_asteroid[2], sv_asteroid[3])
-                #     new.velocity = sv_asteroid[0]
-                #     asteroids.append(new)
-                # self.asteroids = asteroids
-
-                ## algoritmo rápido
-                ## deleta os asteroides que existem no cliente mas não no server e cria asteroides que existem no server mas não no cliente
-                sv_asteroids_id = [asteroid[2] for asteroid in sv_asteroids]
-                cl_asteroids_id = [asteroid.id for asteroid in self.asteroids]
-                destroyed_asteroids = list(set.difference(set(cl_asteroids_id), sv_asteroids_id))
-                new_asteroids = list(set.difference(set(sv_asteroids_id), cl_asteroids_id))
-                #if len(destroyed_asteroids) > 0: print("destroyed: ", str(destroyed_asteroids) )
-                #if len(new_asteroids) > 0: print("new: ", str(new_asteroids) )
-
-                for asteroid in self.asteroids:
-                    for destroyed_asteroid in destroyed_asteroids:
-                        if asteroid.id == destroyed_asteroid:
-                            #print("remove asteroid"+str(asteroid.id))
-                            self.asteroids.remove(asteroid)
-                            break
-                for sv_asteroid in sv_asteroids:
-                    for new_asteroid in new_asteroids:
-                        if sv_asteroid[2] == new_asteroid:
-                            new = Asteroid(sv_asteroid[1], sv_asteroid[2], sv_asteroid[3])
-                            new.velocity = sv_asteroid[0]
-                            #print("add asteroid"+str(new.id))
-                            self.asteroids.append(new)
-                            break
+                # confere se a simulação local dos asteroides continua igual a do servidor
+                if load.checksum is not None:
+                    tick, checksum = load.checksum
+                    if asteroid_checksum(self.asteroids, tick, self.size) != checksum:
+                        self.resync = True
 
                 self.lock.release()
+            except ConnectionError:
+                self.connected = self._reconnect()
             except:
                 pass
 
-    def _connect(self, ip_address, port):
+    # aplica os eventos de nascimento e destruição de asteroides enviados pelo servidor
+    def _apply_asteroid_events(self, asteroid_events):
+        for event in asteroid_events:
+            if event[0] == "reset":
+                self.asteroids = [AsteroidState.from_record(record, self.server_tick_rate) for record in event[1]]
+            elif event[0] == "spawn":
+                self.asteroids.append(AsteroidState.from_record(event[1], self.server_tick_rate))
+            elif event[0] == "destroy":
+                self.asteroids = [asteroid for asteroid in self.asteroids if asteroid.id != event[1]]
+
+    # estimativa do tick atual do servidor, fracionada para os asteroides se moverem suavemente entre pacotes
+    def _current_tick(self):
+        if self.server_tick_time is None:
+            return self.server_tick
+        return self.server_tick + (time.monotonic() - self.server_tick_time) * self.server_tick_rate
+
+    # volta para a partida com o mesmo id (ou como espectador), o servidor reenvia o estado completo:
+    # todos os asteroides num evento reset e as naves no snapshot seguinte
+    def _reconnect(self):
+        hello = "spectator" if self.spaceship is None else ["player", self.spaceship.id, self.token]
+        for attempt in range(self.RECONNECT_ATTEMPTS):
+            print("Cliente: conexão perdida, reconectando ("+str(attempt+1)+"/"+str(self.RECONNECT_ATTEMPTS)+")")
+            try:
+                connection = socket.create_connection(self.server_address, timeout=5)
+                reader = MessageReader(connection)
+                send_message(connection, hello)
+                reader.wait() # handshake, a nave local continua sendo a do jogador
+                if self.spaceship is not None and reader.wait() != "start":
+                    raise ConnectionError("partida não iniciada")
+                connection.settimeout(None)
+            except OSError:
+                time.sleep(self.RECONNECT_DELAY)
+                continue
+            self.lock.acquire()
+            self.connection = connection
+            self.reader = reader
+            self.lock.release()
+            print("Cliente: reconectado")
+            return True
+        return False
+
+    def _connect(self, ip_address, port, role = "player"):
         connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
         # realiza handshake com server
@@ -157,10 +259,20 @@ class Client:
         self.connected = True
 
         # armazena referencias do servidor
+        self.server_address = (ip_address, port)
         self.connection = connection
-
-        # recebe id e posição do servidor
-        client_id, pos, color = pickle.loads(self.connection.recv(2048))
+        self.reader = MessageReader(connection)
+        # informa se é um player ou um espectador
+        send_message(connection, role)
+
+        if role == "spectator":
+            _, self.server_tick_rate = self.reader.wait()
+            self.spaceship = None
+            print("Cliente conectado como espectador")
+            return
+
+        # recebe id, posição, a taxa da simulação do servidor e o token para reconectar com o mesmo id
+        client_id, pos, color, self.server_tick_rate, self.token = self.reader.wait()
         # instancia uma nave com o id e posiçao recebidos
         self.spaceship = Spaceship(pos, client_id, color)
         connection.setblocking(False)
@@ -171,12 +283,38 @@ class Client:
         self.screen.fill((0, 0, 0))
 
         self.lock.acquire()
-        for game_object in self._get_game_objects():
-            game_object.draw(self.screen)
+        game_objects = self._get_game_objects()
+        self.views.draw(self.screen, game_objects)
         self.lock.release()
 
+        if self.show_stats:
+            self._draw_stats(len(game_objects))
         pygame.display.flip()
-        self.clock.tick(self.tick_rate)
+
+    # estatísticas de desempenho, renderizadas de novo apenas algumas vezes por segundo
+    def _draw_stats(self, object_count):
+        now = time.monotonic()
+        if self.stats_surface is None or now - self.stats_time > 0.25:
+            settings = self.governor.settings
+            lines = [
+                "fps: " + str(round(self.clock.get_fps())) + "/" + str(self.tick_rate),
+                "frame: " + format(self.governor.average_frame_time() * 1000, ".1f") + "/" + format(self.governor.budget * 1000, ".1f") + " ms",
+                "qualidade: " + str(self.governor.level) + "/" + str(len(self.governor.LEVELS) - 1),
+                "rotacao: " + str(settings["rotation_step"]) + (" suave" if settings["smooth"] else " simples"),
+                "uplink: 1/" + str(settings["uplink_interval"]) + " render: 1/" + str(settings["render_interval"]),
+                "objetos: " + str(object_count),
+            ]
+            if self.host:
+                lines.append("snapshots: " + str(self.host.snapshot_rate) + "/s")
+            sprites = [render_text(line, self.size.x/54, "sourcecodepro") for line in lines]
+            self.stats_surface = pygame.Surface((max(sprite.get_width() for sprite in sprites), sum(sprite.get_height() for sprite in sprites)), pygame.SRCALPHA)
+            self.stats_surface.fill((0, 0, 0, 0))
+            y = 0
+            for sprite in sprites:
+                self.stats_surface.blit(sprite, (0, y))
+                y += sprite.get_height()
+            self.stats_time = now
+        self.screen.blit(self.stats_surface, (10, 10))
 
     def _get_game_objects(self):
         game_objects = [*self.asteroids, *self.bullets, *self.team, *self.team_bullets]
@@ -186,28 +324,41 @@ class Client:
 
         return game_objects
 
+    # a bala guarda o tick do disparo, para o servidor simulá-la e validar seus acertos
+    def _shoot(self, bullet):
+        bullet.fire_tick = self._current_tick()
+        self.bullets.append(bullet)
+        self.new_shots.append(bullet)
+
     # handler que capta inputs do client durante o jogo
     def _input(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
                 quit()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.show_stats = not self.show_stats
+            # quem criou a sessão ajusta a taxa de snapshots durante o jogo: F5 diminui e F6 aumenta
+            elif self.host and event.type == pygame.KEYDOWN and event.key == pygame.K_F5:
+                self.host.set_snapshot_rate(self.host.snapshot_rate // 2)
+            elif self.host and event.type == pygame.KEYDOWN and event.key == pygame.K_F6:
+                self.host.set_snapshot_rate(self.host.snapshot_rate * 2)
             elif self.spaceship:
                 if (event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE):
                     self.lock.acquire()
-                    self.spaceship.shoot(self.bullets.append, len(self.bullets))
+                    self.spaceship.shoot(self._shoot, len(self.bullets))
                     self.lock.release()
 
         is_key_pressed = pygame.key.get_pressed()
 
         if self.spaceship:
             if is_key_pressed[pygame.K_RIGHT]:
-                self.spaceship.rotate(clockwise=True)
+                self.spaceship.rotate(clockwise=True, scale=self.frame_scale)
             elif is_key_pressed[pygame.K_LEFT]: 
-                self.spaceship.rotate(clockwise=False)
+                self.spaceship.rotate(clockwise=False, scale=self.frame_scale)
             if is_key_pressed[pygame.K_UP]:
-                self.spaceship.accelerate()
+                self.spaceship.accelerate(self.frame_scale)
             elif is_key_pressed[pygame.K_DOWN]:
-                self.spaceship.brake()
+                self.spaceship.brake(self.frame_scale)
 
     def _mainMenu(self):
         self._clear()
@@ -228,8 +379,12 @@ class Client:
         txt2 = load_sprite("2 -> Se juntar a uma sessão",
                            self.size.x/27, "sourcecodepro")
 
+        txt3 = load_sprite("3 -> Assistir uma sessão",
+                           self.size.x/27, "sourcecodepro")
+
         scr.blit(txt1, menu_rect)
         scr.blit(txt2, (menu_rect.x, menu_rect.y + txt1.get_height()*1.1))
+        scr.blit(txt3, (menu_rect.x, menu_rect.y + txt1.get_height()*2.2))
 
         pygame.display.flip()
 
@@ -242,6 +397,8 @@ class Client:
                     self._create_session(menu_rect)
                 elif event.type == pygame.KEYDOWN and (event.key == pygame.K_2 or event.key == pygame.K_KP_2):
                     self._join_session_menu(menu_rect)
+                elif event.type == pygame.KEYDOWN and (event.key == pygame.K_3 or event.key == pygame.K_KP_3):
+                    self._join_session_menu(menu_rect, spectate=True)
 
         self.clock.tick(15)
 
@@ -293,7 +450,8 @@ class Client:
         qtd_players = int(input_qtd_players)
 
         # instancia o servidor
-        host = Server(self.size, qtd_players, self.port, self.ip_address, self.tick_rate, self.lag, self.difficulty)
+        host = Server(self.size, qtd_players, self.port, self.ip_address, self.sim_rate, self.lag, self.difficulty, self.snapshot_rate)
+        self.host = host
 
         server_thread = Thread(target=host.run)
         server_thread.setName("Servidor")
@@ -308,73 +466,76 @@ class Client:
         # conecta ao servidor
         self._connect(ip_address, port)
 
-        # se junta ao lobby
-        pygame.Surface.fill(scr, (0, 0, 0), menu_rect)
-
-        txt1 = load_sprite("Aguardando jogadores...",
-                           self.size.x/27, "sourcecodepro")
-        txt2 = load_sprite("Conectados: ", self.size.x/27, "sourcecodepro")
-
-        scr.blit(txt1, menu_rect)
-        scr.blit(txt2, (menu_rect.x*2.2, menu_rect.y + txt1.get_height()*2))
-
-        input_rect = pygame.Rect(menu_rect.x*2.2 + txt2.get_width(), menu_rect.y + txt1.get_height()*2, self.size.x/10, txt2.get_height())
-
-        pygame.display.flip()
-
-        # aguarda até os jogadores se conectarem ao lobby
-        notDone = True
-        qtd_connected = 0
-        max_players = 1
-        full = False
-        while notDone:
-            # recebe quantos estao conectados
-            if full == False:
-                try: 
-                    qtd_connected, max_players = pickle.loads(self.connection.recv(2048))
-                except:
-                    time.sleep(0.1)
-            full = qtd_connected == max_players
-            # se a sala estiver cheia, aguardar os players estarem prontos
-            if full == False:
-                if qtd_connected != 0:
-                    inp = str(qtd_connected) + "/" + str(max_players)
-                else:
-                    inp = ''
-                spr_connected = load_sprite(inp, self.size.x/27, "sourcecodepro")
-                pygame.Surface.fill(scr, (0, 0, 0), input_rect)
-                scr.blit(spr_connected, input_rect)
-                pygame.display.flip()
-            else:
-                pygame.Surface.fill(scr, (0, 0, 0), menu_rect)
-                txt1 = load_sprite("Jogadores conectados!",self.size.x/27, "sourcecodepro")
-                txt2 = load_sprite("[Espaço] para inciar...",self.size.x/27, "sourcecodepro")
-                scr.blit(txt1, menu_rect)
-                scr.blit(txt2, (menu_rect.x, menu_rect.y + txt1.get_height()*1.1))
-                pygame.display.flip()
+        # o lobby é guiado por mensagens do servidor: "roster" sempre que alguém entra, sai ou fica pronto,
+        # e "start" no início da partida (imediatamente, caso ela já esteja em andamento)
+        qtd_connected, max_players, qtd_ready = 0, 1, 0
+        ready = False
+        started = False
+        lobby_state = None
+        while not started:
+            # a tela só é renderizada de novo quando o estado do lobby muda
+            if (qtd_connected, max_players, qtd_ready, ready) != lobby_state:
+                lobby_state = (qtd_connected, max_players, qtd_ready, ready)
+                self._draw_lobby(menu_rect, qtd_connected, max_players, qtd_ready, ready)
+
+            # acorda assim que chega uma mensagem, o timeout só mantém os eventos da janela respondendo.
+            # mensagens que chegaram junto com o handshake já estão no reader e não deixam o socket legível
+            if self.reader.messages or select.select([self.connection], [], [], 1/30)[0]:
+                message = self.reader.poll()
+                while message is not None and not started:
+                    if message == "start":
+                        started = True
+                    elif isinstance(message, list) and message[0] == "roster":
+                        _, qtd_connected, max_players, qtd_ready = message
+                    # mensagens seguintes ao "start" ficam no reader para o listener do jogo
+                    message = self.reader.poll() if not started else None
 
             for event in pygame.event.get():
                 if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
                     quit()
-                elif (event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE and full):
+                elif (event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE and qtd_connected == max_players and not ready):
                     # envia para o servidor que esse cliente está pronto
-                    self.connection.send(pickle.dumps(True))
-                    scr.fill((0, 0, 0))
-                    pygame.display.flip()
-                    notDone = False
+                    send_message(self.connection, "ready")
+                    ready = True
 
-        # aguarda confirmação do server que o jogo começou
-        while True:
-            try:
-                self.connection.recv(2048)
-                break
-            except:
-                time.sleep(0.1)
+        scr.fill((0, 0, 0))
+        pygame.display.flip()
 
         # inicia o jogo
         self._start_game()
 
-    def _join_session_menu(self, menu_rect):
+    # desenha o estado do lobby, chamado apenas quando ele muda
+    def _draw_lobby(self, menu_rect, qtd_connected, max_players, qtd_ready, ready):
+        scr = self.screen
+        pygame.Surface.fill(scr, (0, 0, 0), menu_rect)
+        if qtd_connected != max_players:
+            txt1 = load_sprite("Aguardando jogadores...", self.size.x/27, "sourcecodepro")
+            txt2 = load_sprite("Conectados: ", self.size.x/27, "sourcecodepro")
+            scr.blit(txt1, menu_rect)
+            scr.blit(txt2, (menu_rect.x*2.2, menu_rect.y + txt1.get_height()*2))
+            if qtd_connected != 0:
+                spr_connected = load_sprite(str(qtd_connected) + "/" + str(max_players), self.size.x/27, "sourcecodepro")
+                scr.blit(spr_connected, (menu_rect.x*2.2 + txt2.get_width(), menu_rect.y + txt1.get_height()*2))
+        else:
+            txt1 = load_sprite("Jogadores conectados!", self.size.x/27, "sourcecodepro")
+            scr.blit(txt1, menu_rect)
+            if ready:
+                txt2 = load_sprite("Prontos: ", self.size.x/27, "sourcecodepro")
+                spr_ready = load_sprite(str(qtd_ready) + "/" + str(max_players), self.size.x/27, "sourcecodepro")
+                scr.blit(spr_ready, (menu_rect.x + txt2.get_width(), menu_rect.y + txt1.get_height()*1.1))
+            else:
+                txt2 = load_sprite("[Espaço] para inciar...", self.size.x/27, "sourcecodepro")
+            scr.blit(txt2, (menu_rect.x, menu_rect.y + txt1.get_height()*1.1))
+        pygame.display.flip()
+
+    # assiste a partida de um servidor ou relay, sem nave
+    def _spectate(self, ip_address, port):
+        self._connect(ip_address, port, "spectator")
+        self.screen.fill((0, 0, 0))
+        pygame.display.flip()
+        self._start_game()
+
+    def _join_session_menu(self, menu_rect, spectate = False):
         scr = self.screen
         pygame.Surface.fill(scr, (0, 0, 0), menu_rect)
 
@@ -413,20 +574,13 @@ class Client:
                         pygame.display.flip()
         
         ip_address, port = input_addr.split(":")
-        self._join_session(menu_rect, ip_address, int(port))
+        if spectate:
+            self._spectate(ip_address, int(port))
+        else:
+            self._join_session(menu_rect, ip_address, int(port))
 
     # carrega dados vindo do server
     def _unpack_server_data(self, server_data : ServerData):
-        spaceships = []
-        for dt_spaceship in server_data.spaceships:
-            spaceship = Spaceship(dt_spaceship[1], None, dt_spaceship[3])
-            spaceship.direction = dt_spaceship[2]
-            spaceship.velocity = dt_spaceship[0]
-            spaceships.append(spaceship)
-        bullets = []
-        for dt_bullet in server_data.bullets:
-            bullet = Bullet(dt_bullet[1], dt_bullet[0], 0, dt_bullet[3], 0)
-            bullets.append(bullet)
-            
-        return spaceships, bullets, server_data.asteroids
-    
\ No newline at end of file
+        spaceships = [ShipState.unpack(dt_spaceship) for dt_spaceship in server_data.spaceships]
+        bullets = [BulletState.unpack(dt_bullet) for dt_bullet in server_data.bullets]
+        return spaceships, bullets
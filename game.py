@@ -1,6 +1,7 @@
 ## NOME: Vinícius Costalunga Lima
 
 ## instalar requirements.txt antes de executar
+## opcional: gerar o atlas de sprites com python atlas.py, acelera a inicialização e o menu
 
 from client import Client
 
@@ -10,5 +11,7 @@ port = 5000
 lag = 0 # em segundos, recomendado para testar de 0.1~1
 tick_rate = 120 # fps que o jogo será rodado
 difficulty = 1 # não utilizado no momento
+sim_rate = 60 # ticks por segundo da simulação no servidor
+snapshot_rate = 30 # snapshots por segundo enviados pelo servidor, menos economiza banda e cpu
 
-Client = Client((width, width/1.2), tick_rate, ip_address, lag, port, difficulty)
\ No newline at end of file
+Client = Client((width, width/1.2), tick_rate, ip_address, lag, port, difficulty, sim_rate, snapshot_rate)
\ No newline at end of file
@@ -0,0 +1,61 @@
+# controle do orçamento de tempo de cada frame do cliente
+# mede os frames recentes e diminui a qualidade quando o orçamento (1/fps) é estourado,
+# voltando a aumentar quando há folga. assim máquinas fracas mantêm o fps estável em cenas pesadas
+
+from collections import deque
+
+class FrameGovernor:
+    WINDOW = 60 # frames avaliados antes de mudar a qualidade
+    MISS_RATIO = 0.25 # fração de frames acima do orçamento que faz a qualidade diminuir
+    HEADROOM = 0.5 # a qualidade aumenta quando todos os frames usam menos que essa fração do orçamento
+    # níveis de qualidade, do melhor para o pior:
+    # rotation_step: passo em graus da rotação da nave, passos maiores reaproveitam mais o cache de rotação
+    # smooth: rotaciona com antialiasing (rotozoom) ou não (rotate)
+    # uplink_interval: envia dados ao servidor a cada N frames
+    # render_interval: desenha a tela a cada N frames
+    LEVELS = [
+        {"rotation_step": 1, "smooth": True, "uplink_interval": 1, "render_interval": 1},
+        {"rotation_step": 6, "smooth": True, "uplink_interval": 1, "render_interval": 1},
+        {"rotation_step": 6, "smooth": False, "uplink_interval": 1, "render_interval": 1},
+        {"rotation_step": 6, "smooth": False, "uplink_interval": 2, "render_interval": 1},
+        {"rotation_step": 6, "smooth": False, "uplink_interval": 2, "render_interval": 2},
+    ]
+
+    def __init__(self, frame_rate):
+        self.budget = 1 / frame_rate # segundos disponíveis por frame
+        self.frame_times = deque(maxlen=self.WINDOW)
+        self.level = 0
+        self.frame_count = 0
+
+    @property
+    def settings(self):
+        return self.LEVELS[self.level]
+
+    def should_render(self):
+        return self.frame_count % self.settings["render_interval"] == 0
+
+    def should_send(self):
+        return self.frame_count % self.settings["uplink_interval"] == 0
+
+    def average_frame_time(self):
+        if not self.frame_times:
+            return 0
+        return sum(self.frame_times) / len(self.frame_times)
+
+    # registra o tempo de trabalho do frame (sem a espera do clock) e ajusta a qualidade, retorna True caso tenha mudado
+    def record(self, frame_time):
+        self.frame_times.append(frame_time)
+        self.frame_count += 1
+        if len(self.frame_times) < self.WINDOW:
+            return False
+
+        missed = sum(1 for time in self.frame_times if time > self.budget) / len(self.frame_times)
+        if missed > self.MISS_RATIO and self.level < len(self.LEVELS) - 1:
+            self.level += 1
+        elif max(self.frame_times) < self.budget * self.HEADROOM and self.level > 0:
+            self.level -= 1
+        else:
+            return False
+        # a janela recomeça para medir os frames já com a nova qualidade
+        self.frame_times.clear()
+        return True
@@ -1,9 +1,14 @@
 # fonte: https://realpython.com/asteroids-game-python/#step-4-controlling-game-objects
 # modificado para suportar diversos players e online
 
+import copy
+import math
+import select
+import time
 import uuid
+from collections import deque
+from threading import Lock
 from pygame.math import Vector2
-from pygame.transform import rotozoom, rotate
 import util
 
 UP = Vector2(0, -1)
@@ -13,50 +18,382 @@ RIGHT = Vector2(1, 0)
 
 ### modelos referentes a passagem de dados via socket ###
 class ServerClient:
-    def __init__(self, id, connection):
+    MAX_PENDING = 1 # snapshots aguardando envio, os mais antigos são descartados
+    LAG_WINDOW = 120 # ticks do server avaliados antes de ajustar a taxa do cliente
+    LAG_TOLERANCE = 0.1 # fração de snapshots descartados na janela a partir da qual o cliente é considerado atrasado
+    MAX_SNAPSHOT_INTERVAL = 8 # menor taxa: um a cada 8 snapshots do server
+    MAX_LAG_WINDOWS = 5 # janelas seguidas atrasado na menor taxa antes de desconectar
+
+    def __init__(self, id, connection, reader = None):
         self.id = id
         self.connection = connection
+        self.connected = True
+        self.reader = reader or MessageReader(connection)
+        self.asteroid_events = [] # eventos de asteroides ainda não enviados a esse cliente
+        self.needs_reset = False # perdeu eventos de asteroides que não puderam ser reaproveitados
+        self.pending = deque() # fila de saída, serializada apenas quando o socket tem espaço
+        self.control = deque() # mensagens do lobby, nunca descartadas e escritas antes dos snapshots
+        self.out_buffer = b"" # restante da mensagem que está sendo escrita no socket
+        self.snapshot_interval = 1 # recebe um a cada snapshot_interval snapshots do server
+        self.snapshot_count = 0
+        self.window_start = None # tick do server em que a janela atual começou
+        self.window_snapshots = 0
+        self.window_dropped = 0
+        self.window_sent = False # algum byte foi escrito no socket durante a janela
+        self.lag_windows = 0
+
+    # clientes atrasados pulam snapshots, os eventos de asteroides ficam guardados até o próximo.
+    # a janela de atraso avança pelos ticks do server, não pelos snapshots que o cliente quer,
+    # assim um cliente parado na menor taxa é desconectado em tempo limitado
+    def wants_snapshot(self, tick):
+        if self.window_start is None:
+            self.window_start = tick
+        elif tick - self.window_start >= self.LAG_WINDOW:
+            self._adjust_rate()
+            self.window_start = tick
+        self.snapshot_count += 1
+        return self.snapshot_count % self.snapshot_interval == 0
+
+    # coloca um snapshot na fila de saída, descartando o mais antigo caso a fila esteja cheia
+    def enqueue(self, server_data):
+        self.pending.append(server_data)
+        if len(self.pending) > self.MAX_PENDING:
+            stale = self.pending.popleft()
+            # eventos de asteroides não podem se perder junto com o snapshot descartado.
+            # snapshots já serializados (compartilhados entre espectadores) não podem ser mesclados, então pede um reset
+            if isinstance(stale, bytes) or isinstance(self.pending[0], bytes):
+                self.needs_reset = True
+            else:
+                merged = copy.copy(self.pending[0])
+                merged.asteroid_events = stale.asteroid_events + merged.asteroid_events
+                self.pending[0] = merged
+            self.window_dropped += 1
+        self.window_snapshots += 1
+
+    def send_control(self, message):
+        self.control.append(message)
+
+    # escreve no socket sem bloquear o quanto couber, retorna False se a conexão caiu
+    def flush(self):
+        while True:
+            if not self.out_buffer:
+                if not self.control and not self.pending:
+                    return True
+                message = self.control.popleft() if self.control else self.pending.popleft()
+                self.out_buffer = message if isinstance(message, bytes) else util.pack_message(message)
+            try:
+                sent = self.connection.send(self.out_buffer)
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+            self.out_buffer = self.out_buffer[sent:]
+            if sent:
+                self.window_sent = True
+            if self.out_buffer:
+                return True
+
+    def is_too_slow(self):
+        return self.lag_windows >= self.MAX_LAG_WINDOWS
+
+    # diminui a taxa de snapshots de clientes atrasados e volta a aumentar quando se recuperam.
+    # um cliente que não leu nada durante a janela inteira, com dados esperando, também está atrasado
+    def _adjust_rate(self):
+        stalled = bool(self.out_buffer or self.pending) and not self.window_sent
+        if stalled or self.window_dropped > self.LAG_TOLERANCE * self.window_snapshots:
+            if self.snapshot_interval < self.MAX_SNAPSHOT_INTERVAL:
+                self.snapshot_interval *= 2
+            else:
+                self.lag_windows += 1
+        else:
+            self.lag_windows = 0
+            if self.window_dropped == 0 and self.snapshot_interval > 1:
+                self.snapshot_interval //= 2
+        self.window_snapshots = 0
+        self.window_dropped = 0
+        self.window_sent = False
+
+# espectadores de um server ou relay. recebem todos o mesmo snapshot, serializado uma única vez
+class SpectatorGroup:
+    def __init__(self):
+        self.spectators = []
+        self.lock = Lock()
+
+    def add(self, spectator):
+        spectator.needs_reset = True # primeiro snapshot leva o estado completo dos asteroides
+        spectator.connection.setblocking(False)
+        self.lock.acquire()
+        self.spectators.append(spectator)
+        self.lock.release()
+
+    def remove(self, spectator):
+        self.lock.acquire()
+        if spectator in self.spectators:
+            self.spectators.remove(spectator)
+        self.lock.release()
+        spectator.connected = False
+        try:
+            spectator.connection.close()
+        except:
+            pass
+
+    def needs_reset(self):
+        return any(spectator.needs_reset for spectator in self.spectators)
+
+    # reset_event é o estado completo dos asteroides, obrigatório caso needs_reset() seja verdadeiro
+    def broadcast(self, server_data, reset_event = None):
+        packed = None
+        for spectator in self.spectators[:]:
+            if not spectator.wants_snapshot(server_data.tick):
+                if server_data.asteroid_events:
+                    spectator.needs_reset = True
+                continue
+            if spectator.needs_reset and reset_event is not None:
+                private = copy.copy(server_data)
+                private.asteroid_events = [reset_event]
+                spectator.needs_reset = False
+                spectator.enqueue(private)
+            else:
+                if packed is None:
+                    packed = util.pack_message(server_data)
+                spectator.enqueue(packed)
+            if not spectator.flush() or spectator.is_too_slow():
+                self.remove(spectator)
+
+    # recebe pedidos de resync de todos os espectadores numa única thread
+    def listen(self):
+        while True:
+            spectators = self.spectators[:]
+            if not spectators:
+                time.sleep(0.5)
+                continue
+            try:
+                readable, _, _ = select.select([spectator.connection for spectator in spectators], [], [], 0.5)
+            except (OSError, ValueError):
+                continue
+            for spectator in spectators:
+                if spectator.connection not in readable:
+                    continue
+                try:
+                    message = spectator.reader.poll()
+                    while message is not None:
+                        if message == "resync":
+                            spectator.needs_reset = True
+                        message = spectator.reader.poll()
+                except (OSError, ValueError):
+                    self.remove(spectator)
+
+# separa as mensagens recebidas pelo socket (ver util.pack_message)
+class MessageReader:
+    def __init__(self, connection):
+        self.connection = connection
+        self.buffer = bytearray()
+        self.messages = deque()
+
+    # retorna a próxima mensagem completa, ou None caso ainda não tenha chegado inteira
+    def poll(self):
+        if not self.messages:
+            try:
+                data = self.connection.recv(65536)
+            except BlockingIOError:
+                return None
+            if not data:
+                raise ConnectionError("conexão encerrada")
+            self.buffer += data
+            self.messages.extend(util.unpack_messages(self.buffer))
+        if self.messages:
+            return self.messages.popleft()
+        return None
+
+    # aguarda uma mensagem, apenas para sockets em modo bloqueante
+    def wait(self):
+        message = self.poll()
+        while message is None:
+            message = self.poll()
+        return message
 
 # tipo de dado transportado do server para o cliente
+# asteroides não são enviados a cada tick, apenas os eventos de nascimento/destruição e um checksum ocasional
 class ServerData:
-    def __init__(self, spaceships, bullets, asteroids):
-        self.spaceships = []
-        for spaceship in spaceships:
-            self.spaceships.append([spaceship.velocity, spaceship.position, spaceship.direction, spaceship.color])
-        self.bullets = []
-        for bullet in bullets:
-            self.bullets.append([bullet.velocity, bullet.position, bullet.id, bullet.color])
-        self.asteroids = []
-        for asteroid in asteroids:
-            self.asteroids.append([asteroid.velocity, asteroid.position, asteroid.id, asteroid.size])
+    def __init__(self, tick, spaceships, bullets, asteroid_events, checksum = None):
+        self.tick = tick
+        self.spaceships = [spaceship.pack() for spaceship in spaceships] # ShipState.pack()
+        self.bullets = [bullet.pack() for bullet in bullets] # BulletState.pack()
+        self.asteroid_events = asteroid_events # ["spawn", registro], ["destroy", id, tick] ou ["reset", registros]
+        self.checksum = checksum # [tick, crc] ou None
 
 # tipo de dado transportado do cliente para o server
+# balas são enviadas uma única vez, quando disparadas. acertos e morte são pedidos validados pelo server
 class ClientData:
-    def __init__(self, spaceship, bullets, hit_asteroids, game_over):
-        self.spaceship = [spaceship.velocity, spaceship.position, spaceship.direction]
-        self.bullets = []
-        for bullet in bullets:
-            self.bullets.append([bullet.velocity, bullet.position, bullet.id, bullet.color])
-        self.hit_asteroids = hit_asteroids
-        self.game_over = game_over
+    def __init__(self, spaceship, shots, hit_claims, game_over_tick, ack_tick, resync = False):
+        self.spaceship = spaceship.state().pack()
+        self.shots = [bullet.shot() for bullet in shots] # balas disparadas desde o último envio
+        self.hit_claims = hit_claims # [id da bala, id do asteroide, tick]
+        self.game_over_tick = game_over_tick # tick em que a nave colidiu, ou None
+        self.ack_tick = ack_tick # último tick recebido do server
+        self.resync = resync # pede ao server o estado completo dos asteroides
 
 ### modelos referentes ao jogo ###
+# os modelos guardam apenas estado, sprites e caches de rotação ficam na camada de renderização do cliente (views.py)
+SPACESHIP_SIZE = 36
+
+# estados compactos, sem __dict__ nem Vector2, usados pelo server, pela rede e para as entidades de outros players.
+# posição, velocidade e direção são tuplas (x, y)
+class State:
+    __slots__ = ()
+
+    def collides_with(self, other_obj):
+        x, y = self.position
+        other_x, other_y = other_obj.position
+        return math.hypot(x - other_x, y - other_y) < self.radius + other_obj.radius
+
+    # scale converte a velocidade para a taxa de quem está simulando (ex: server a 60 ticks usa scale 2)
+    def move(self, size, scale = 1):
+        x, y = self.position
+        vx, vy = self.velocity
+        self.position = ((x + vx * scale) % size[0], (y + vy * scale) % size[1])
+
+    # tupla plana enviada pela rede
+    def pack(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    @classmethod
+    def unpack(cls, data):
+        return cls(*data)
+
+class ShipState(State):
+    __slots__ = ("id", "position", "velocity", "direction", "color")
+
+    def __init__(self, id, position, velocity, direction, color):
+        self.id = id
+        self.position = position
+        self.velocity = velocity
+        self.direction = direction
+        self.color = color
+
+    @property
+    def radius(self):
+        return Spaceship.RADIUS
+
+class BulletState(State):
+    __slots__ = ("id", "position", "velocity", "color")
+
+    def __init__(self, id, position, velocity, color):
+        self.id = id
+        self.position = position
+        self.velocity = velocity
+        self.color = color
+
+    @property
+    def radius(self):
+        return Bullet.RADIUS
+
+    # balas não dão a volta na tela
+    def move(self, size, scale = 1):
+        x, y = self.position
+        vx, vy = self.velocity
+        self.position = (x + vx * scale, y + vy * scale)
+
+# o movimento do asteroide é determinístico: a posição em qualquer tick é calculada em ponto fixo
+# a partir da posição e tick de nascimento e da velocidade gerada pela seed
+class AsteroidState(State):
+    __slots__ = ("id", "size", "seed", "spawn_tick", "tick_rate", "spawn_position", "fixed_velocity", "position")
+    MAX_SPEED = 3
+    MIN_SPEED = 1
+    # raio de colisão por tamanho, aproximadamente metade da largura do sprite
+    RADIUS = {
+        3: SPACESHIP_SIZE * 3.8,
+        2: SPACESHIP_SIZE * 1.9,
+        1: SPACESHIP_SIZE * 0.95
+    }
+
+    def __init__(self, id, size, seed, spawn_tick, spawn_position, tick_rate = 120):
+        self.id = id
+        self.size = size
+        self.seed = seed
+        self.spawn_tick = spawn_tick
+        self.tick_rate = tick_rate
+        self.spawn_position = spawn_position # em ponto fixo
+        # velocidade por tick da simulação do server, que pode ter taxa diferente da de referência
+        self.fixed_velocity = util.get_seeded_velocity(seed, self.MIN_SPEED, self.MAX_SPEED, GameObject.REFERENCE_RATE / (3 * tick_rate))
+        self.position = (util.from_fixed(spawn_position[0]), util.from_fixed(spawn_position[1]))
+
+    @property
+    def radius(self):
+        return self.RADIUS[self.size]
+
+    # registro enviado pela rede para o cliente reconstruir o asteroide
+    @classmethod
+    def from_record(cls, record, tick_rate = 120):
+        id, seed, spawn_tick, size, x, y = record
+        return cls(id, size, seed, spawn_tick, (x, y), tick_rate)
+
+    def record(self):
+        return [self.id, self.seed, self.spawn_tick, self.size, *self.spawn_position]
+
+    # com tick inteiro o resultado é exato, com tick fracionado serve apenas para desenhar entre ticks
+    def fixed_position_at(self, tick, size):
+        w, h = util.fixed_size(size)
+        dt = tick - self.spawn_tick
+        x = (self.spawn_position[0] + self.fixed_velocity[0] * dt) % w
+        y = (self.spawn_position[1] + self.fixed_velocity[1] * dt) % h
+        return x, y
+
+    def move(self, size, tick):
+        x, y = self.fixed_position_at(tick, size)
+        self.position = (util.from_fixed(x), util.from_fixed(y))
+
+    # os filhos nascem na posição exata do pai no tick da divisão
+    def split(self, tick, size, ids, seeds):
+        if self.size > 1:
+            position = self.fixed_position_at(tick, size)
+            return [AsteroidState(id, self.size - 1, seed, tick, position, self.tick_rate) for id, seed in zip(ids, seeds)]
+        else:
+            return False
+
+# histórico circular dos estados recentes do mundo, indexado por tick.
+# usado pelo server para voltar ao tick visto pelo cliente e validar acertos e colisões
+class StateHistory:
+    def __init__(self, size):
+        self.states = deque(maxlen=size)
+
+    # guarda a posição e o raio de cada asteroide vivo no tick, e a posição e a velocidade de cada nave
+    def record(self, tick, asteroids, spaceships = ()):
+        self.states.append((tick,
+                            {asteroid.id: (*asteroid.position, asteroid.radius) for asteroid in asteroids},
+                            {spaceship.id: (*spaceship.position, *spaceship.velocity) for spaceship in spaceships}))
+
+    # retorna os asteroides no tick, ou None caso o tick não esteja mais no histórico
+    def at(self, tick):
+        state = self._state(tick)
+        return state[1] if state is not None else None
+
+    # retorna as naves no tick, id -> (x, y, vx, vy), ou None caso o tick não esteja mais no histórico
+    def ships_at(self, tick):
+        state = self._state(tick)
+        return state[2] if state is not None else None
+
+    def _state(self, tick):
+        if not self.states:
+            return None
+        index = tick - self.states[0][0]
+        if 0 <= index < len(self.states):
+            return self.states[index]
+        return None
+
+# entidades controladas pelo próprio cliente, com a física do jogo
 class GameObject:
-    SPACESHIP_SIZE = 36
+    SPACESHIP_SIZE = SPACESHIP_SIZE
+    REFERENCE_RATE = 120 # velocidades são em pixels por frame a 120 fps
 
-    def __init__(self, position, sprite, velocity):
+    def __init__(self, position, radius, velocity):
         self.position = Vector2(position)
-        self.sprite = sprite
-        self.radius = sprite.get_width() / 2
+        self.radius = radius
         self.velocity = Vector2(velocity)
 
-    def draw(self, surface):
-        #pygame.draw.rect(self.sprite, pygame.Color(255,255,255), [0, 0, self.sprite.get_width(), self.sprite.get_height()], 1)
-        blit_position = self.position - Vector2(self.radius)
-        surface.blit(self.sprite, blit_position)
-
-    def move(self, size):
-        self.position = util.wrap_position(self.position + self.velocity, size)
+    # scale converte a velocidade para a taxa de quem está simulando (ex: server a 60 ticks usa scale 2)
+    def move(self, size, scale = 1):
+        self.position = util.wrap_position(self.position + self.velocity * scale, size)
 
     def collides_with(self, other_obj):
         distance = self.position.distance_to(other_obj.position)
@@ -67,34 +404,30 @@ class Spaceship(GameObject):
     ACCELERATION = 0.15
     MAX_SPEED = 3
     COLLISION_RADIUS = 0.3
+    RADIUS = SPACESHIP_SIZE * 0.48 * COLLISION_RADIUS
     BULLET_SPEED = 4
     MAX_BULLETS = 3
+    BULLET_OFFSET = (SPACESHIP_SIZE/12, -SPACESHIP_SIZE/2.4) # offset pra bala sair do centro da nave
 
     def __init__(self, position, spaceship_id, color):
         self.id = spaceship_id
         self.direction = Vector2(UP)
         self.color = color
-        super().__init__(position, util.load_sprite(">", self.SPACESHIP_SIZE, "lucidasans", self.SPACESHIP_SIZE/6, self.SPACESHIP_SIZE/5, color), Vector2(0))
-        self.sprite = rotate(self.sprite, 90)
-        self.radius = self.radius * self.COLLISION_RADIUS
+        super().__init__(position, self.RADIUS, Vector2(0))
         self.last_bullet = 0
 
-    def rotate(self, clockwise=True):
+    def state(self):
+        return ShipState(self.id, tuple(self.position), tuple(self.velocity), tuple(self.direction), self.color)
+
+    # scale é a duração do frame em frames de referência, como em move
+    def rotate(self, clockwise=True, scale = 1):
         sign = 1 if clockwise else -1
-        angle = self.MANEUVERABILITY * sign
+        angle = self.MANEUVERABILITY * sign * scale
         self.direction.rotate_ip(angle)
 
-    def draw(self, surface):
-        #pygame.draw.rect(self.sprite, pygame.Color(255,255,255), [0, 0, self.sprite.get_width(), self.sprite.get_height()], 1)
-        angle = self.direction.angle_to(UP)
-        rotated_surface = rotozoom(self.sprite, angle, 1.0)
-        rotated_surface_size = Vector2(rotated_surface.get_size())
-        blit_position = self.position - rotated_surface_size * 0.5
-        surface.blit(rotated_surface, blit_position)
-        
-    def accelerate(self):
+    def accelerate(self, scale = 1):
         vel = self.velocity
-        vel += self.direction * self.ACCELERATION
+        vel += self.direction * self.ACCELERATION * scale
         # calcula velocidade maxima
         sum = abs(vel.x) + abs(vel.y)
         if sum > self.MAX_SPEED:
@@ -105,51 +438,45 @@ class Spaceship(GameObject):
         self.velocity = vel
         #print("dirx: %.2f   diry: %.2f     velx: %.2f   vely: %.2f   velt: %.2f" % (self.direction.x, self.direction.y, self.velocity.x, self.velocity.y, abs(self.velocity.x) + abs(self.velocity.y)))
     
-    def brake(self):
-        self.velocity -= self.velocity * (self.ACCELERATION / 3)
+    def brake(self, scale = 1):
+        self.velocity -= self.velocity * (self.ACCELERATION / 3 * scale)
 
     def shoot(self, create_bullet_callback, num):
         if num < self.MAX_BULLETS:
-            # offset pra bala sair do centro da nave
-            bullet_x = self.position.x + self.SPACESHIP_SIZE/12
-            bullet_y = self.position.y - self.SPACESHIP_SIZE/2.4
+            bullet_x = self.position.x + self.BULLET_OFFSET[0]
+            bullet_y = self.position.y + self.BULLET_OFFSET[1]
             bullet_velocity = self.direction * self.BULLET_SPEED + self.velocity
-            bullet = Bullet((bullet_x,bullet_y), bullet_velocity, self.id, self.color)
+            bullet = Bullet((bullet_x,bullet_y), bullet_velocity, self.id, self.color, uuid.uuid1().int)
             create_bullet_callback(bullet)
 
-class Asteroid(GameObject):
-    MAX_SPEED = 3
-    MIN_SPEED = 1
-
-    def __init__(self, position, id = uuid.uuid1().int, size = 3):
-        self.size = size
-        self.id = id
+class Bullet(GameObject):
+    RADIUS = SPACESHIP_SIZE * 0.275
 
-        size_to_scale = {
-            3: 1,
-            2: 0.5,
-            1: 0.25
-        }
+    def __init__(self, position, velocity, spaceship_id, color, bullet_id = None, fire_tick = 0):
+        self.spaceship_id = spaceship_id
+        self.id = bullet_id if bullet_id is not None else uuid.uuid1().int # id novo a cada bala
+        self.color = color
+        self.origin = tuple(position)
+        self.fire_tick = fire_tick # tick do server em que a bala foi disparada
+        super().__init__(position, self.RADIUS, velocity)
 
-        scale = size_to_scale[size]
-        sprite = rotozoom(util.load_sprite("o", self.SPACESHIP_SIZE*15, "consolas", self.SPACESHIP_SIZE*10/15, self.SPACESHIP_SIZE*10/2.1), 0, scale)
+    # posição da bala em qualquer tick do server, inclusive fracionado. cliente e server usam a mesma fórmula,
+    # assim o acerto visto pelo cliente é exatamente o que o server confere, independente do fps do cliente
+    @staticmethod
+    def position_at(origin, velocity, fire_tick, tick, scale):
+        elapsed = (tick - fire_tick) * scale
+        return (origin[0] + velocity[0] * elapsed, origin[1] + velocity[1] * elapsed)
 
-        super().__init__(position, sprite, util.get_random_velocity(self.MIN_SPEED, self.MAX_SPEED)/3)
+    # scale converte ticks do server em frames de referência (GameObject.REFERENCE_RATE / taxa do server)
+    def move_to(self, tick, scale):
+        self.position = Vector2(self.position_at(self.origin, self.velocity, self.fire_tick, tick, scale))
 
-    def split(self):
-        if self.size > 1:
-            asteroid1 = Asteroid(self.position, uuid.uuid1().int, self.size - 1)
-            asteroid2 = Asteroid(self.position, uuid.uuid1().int, self.size - 1)
-            return [asteroid1, asteroid2]
-        else:
-            return False                
+    # disparo enviado ao server, que calcula a posição da bala em qualquer tick a partir dele
+    def shot(self):
+        return (self.id, self.origin, tuple(self.velocity), self.color, self.fire_tick)
 
-class Bullet(GameObject):
-    def __init__(self, position, velocity, spaceship_id, color, bullet_id = uuid.uuid1().int):
-        self.spaceship_id = spaceship_id
-        self.id = bullet_id
-        self.color = color
-        super().__init__(position, util.load_sprite(".", self.SPACESHIP_SIZE, "consolas", color=color), velocity)
+    def state(self):
+        return BulletState(self.id, tuple(self.position), tuple(self.velocity), self.color)
 
-    def move(self, size):
-        self.position = self.position + self.velocity
\ No newline at end of file
+    def move(self, size, scale = 1):
+        self.position = self.position + self.velocity * scale
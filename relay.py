@@ -0,0 +1,119 @@
+# relay de espectadores
+# se inscreve uma única vez como espectador em um servidor (ou em outro relay) e retransmite
+# os snapshots para vários espectadores, com um atraso configurável.
+# assim o custo do servidor por tick é o de um espectador, independente de quantos estejam assistindo
+# uso: python relay.py <ip:porta de origem> <porta local> [atraso em segundos]
+# ex, dois relays encadeados na mesma máquina:
+#   python relay.py localhost:5000 5001 2
+#   python relay.py localhost:5001 5002
+
+import socket
+import sys
+import time
+from collections import deque
+from threading import Lock, Thread
+from models import ServerClient, MessageReader, SpectatorGroup
+from util import create_socket, send_message
+
+class Relay:
+    def __init__(self, upstream_ip_address, upstream_port, port, ip_address = "localhost", delay = 0):
+        self.upstream_ip_address = upstream_ip_address
+        self.upstream_port = upstream_port
+        self.port = port
+        self.ip_address = ip_address
+        self.delay = delay # atraso em segundos entre receber e retransmitir um snapshot
+        self.spectators = SpectatorGroup()
+        self.buffer = deque() # snapshots recebidos aguardando o atraso, (momento recebido, snapshot)
+        self.lock = Lock()
+        self.asteroids = {} # registros dos asteroides no último snapshot retransmitido, id -> registro
+        self.tick_rate = None
+
+    def run(self):
+        self._connect()
+        self._create_acceptor()
+        listener_thread = Thread(target=self.spectators.listen)
+        listener_thread.setName("Relay: Listener espectadores")
+        listener_thread.start()
+        self._loop()
+
+    # se inscreve como espectador na origem
+    def _connect(self):
+        connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        connection.connect((self.upstream_ip_address, self.upstream_port))
+        send_message(connection, "spectator")
+        self.upstream = MessageReader(connection)
+        role, self.tick_rate = self.upstream.wait()
+        print("Relay: inscrito em " + self.upstream_ip_address + ":" + str(self.upstream_port))
+
+        upstream_thread = Thread(target=self._upstream_listener)
+        upstream_thread.setName("Relay: Listener origem")
+        upstream_thread.start()
+
+    def _upstream_listener(self):
+        while True:
+            try:
+                server_data = self.upstream.wait()
+            except OSError:
+                print("Relay: conexão com a origem perdida")
+                return
+            self.lock.acquire()
+            self.buffer.append((time.monotonic(), server_data))
+            self.lock.release()
+
+    # retransmite os snapshots cujo atraso já passou
+    def _loop(self):
+        while True:
+            now = time.monotonic()
+            ready = []
+            self.lock.acquire()
+            while self.buffer and self.buffer[0][0] + self.delay <= now:
+                ready.append(self.buffer.popleft()[1])
+            wait = self.buffer[0][0] + self.delay - now if self.buffer else 0.005
+            self.lock.release()
+
+            for server_data in ready:
+                # o estado dos asteroides acompanha o snapshot retransmitido, não o último recebido
+                self._apply_asteroid_events(server_data.asteroid_events)
+                reset_event = None
+                if self.spectators.needs_reset():
+                    reset_event = ["reset", list(self.asteroids.values())]
+                self.spectators.broadcast(server_data, reset_event)
+            time.sleep(min(max(wait, 0.001), 0.005))
+
+    def _apply_asteroid_events(self, asteroid_events):
+        for event in asteroid_events:
+            if event[0] == "reset":
+                self.asteroids = {record[0]: record for record in event[1]}
+            elif event[0] == "spawn":
+                self.asteroids[event[1][0]] = event[1]
+            elif event[0] == "destroy":
+                self.asteroids.pop(event[1], None)
+
+    def _create_acceptor(self):
+        self.server_socket = create_socket(self.ip_address, self.port)
+        acceptor_thread = Thread(target=self._acceptor)
+        acceptor_thread.setName("Relay: Espectadores")
+        acceptor_thread.start()
+
+    # aceita espectadores (ou outros relays) com o mesmo handshake do servidor
+    def _acceptor(self):
+        while True:
+            connection, addr = self.server_socket.accept()
+            try:
+                connection.settimeout(5)
+                reader = MessageReader(connection)
+                if reader.wait() == "spectator":
+                    connection.settimeout(None)
+                    send_message(connection, ["spectator", self.tick_rate])
+                    self.spectators.add(ServerClient(0, connection, reader))
+                    print("Relay: espectador " + str(addr[0])+":"+ str(addr[1]) + " conectado")
+                else:
+                    print("Relay: apenas espectadores, conexão " + str(addr[0])+":"+ str(addr[1]) + " recusada")
+                    connection.close()
+            except OSError:
+                connection.close()
+
+if __name__ == "__main__":
+    upstream_ip_address, upstream_port = sys.argv[1].split(":")
+    delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+    Relay(upstream_ip_address, int(upstream_port), int(sys.argv[2]), delay=delay).run()
@@ -2,32 +2,73 @@
 # instanciada quando um cliente cria uma sessão
 # aqui ocorre o processamento dos asteroides, seu percurso de vida e onde nascem novos
 
-import pickle
-from threading import Lock, Thread
+import math
+import random
+import select
+from threading import Event, Lock, Thread
 import time
+import traceback
+import uuid
 from webbrowser import get
 from pygame import Vector2
-import pygame
-from util import create_socket, get_random_position
-from models import ServerClient, Asteroid, Spaceship, Bullet, ServerData, ClientData
+from util import create_socket, get_random_position, asteroid_checksum, to_fixed, from_fixed, send_message
+from models import ServerClient, AsteroidState, ShipState, BulletState, GameObject, Spaceship, Bullet, StateHistory, ServerData, MessageReader, SpectatorGroup
+
+# formato dos dados recebidos dos clientes, conferido antes de desempacotar
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def _is_point(value):
+    return isinstance(value, (list, tuple)) and len(value) == 2 and all(_is_number(coordinate) for coordinate in value)
+
+def _is_records(records, length):
+    return isinstance(records, (list, tuple)) and all(isinstance(record, (list, tuple)) and len(record) == length for record in records)
+
+# menor diferença entre duas coordenadas num mapa que dá a volta
+def _wrap_delta(delta, length):
+    return (delta + length / 2) % length - length / 2
 
 class Server:
+    CHECKSUM_INTERVAL = 60 # mínimo de ticks entre checksums dos asteroides
+    MAX_CATCHUP_TICKS = 5 # ticks atrasados executados de uma vez antes de descartar o atraso
+    HISTORY_TICKS = 120 # ticks guardados para validar acertos e colisões informados pelos clientes
+    MAX_EXTRAPOLATION_TICKS = 30 # quanto o cliente pode estar à frente do último tick que recebeu
+    HIT_TOLERANCE = 6 # pixels de tolerância nas validações, para diferenças de arredondamento do cliente
+    SHOT_SPEED_TOLERANCE = 0.1 # tolerância na velocidade da bala relativa à nave, em pixels por frame
+    REJECTED_SHOTS_LOG = 100 # disparos recusados de um cliente entre um aviso e outro no console
     COLORS = [(224,224,224), (0, 252, 67), (245, 0, 0), (99, 112, 255) ,(255, 238, 0), (56, 252, 239), (209, 84, 0), (222, 27, 206)]
-    def __init__(self, size: Vector2, qtd_players, port, ip_address = "localhost", tick_rate = 120, lag = 0, difficulty = 1):
-        self.tick_rate = tick_rate # tempo de processamento do jogo, deve ser mesmo do cliente
+    def __init__(self, size: Vector2, qtd_players, port, ip_address = "localhost", tick_rate = 60, lag = 0, difficulty = 1, snapshot_rate = 30):
+        self.tick_rate = tick_rate # ticks da simulação por segundo, independente do fps do cliente
+        self.snapshot_rate = snapshot_rate # snapshots enviados por segundo, pode ser alterado durante o jogo
+        self.frame_scale = GameObject.REFERENCE_RATE / tick_rate # converte velocidades por frame para velocidades por tick
         self.size = Vector2(size) # tamanho da tela do jogo
         self.lag = lag # lag artifical para testes
         self.qtd_players = qtd_players
         self.ip_address = ip_address
         self.port = port
-        self.clock = pygame.time.Clock()
         self.clients = []
+        self.spectators = SpectatorGroup() # conexões somente leitura, normalmente um relay (ver relay.py)
+        self.spectator_events = [] # eventos de asteroides ainda não enviados aos espectadores
         self.difficulty = difficulty # não utilizado, tempo para nascer asteroides
         self.spawn_timers = [9999,5,3,1,0.2] # não utilizado, tempo para nascer asteroides
         self.dist_buffer = size.x/7
         self.max_asteroids = 15 # não utilizado, max de asteroides no mapa
         self.lock = Lock() # lock para resolver race conditions
         self.spawn_timer = time.time() # não utilizado, tempo para nascer asteroides
+        self.tick = 0 # tick atual da simulação, usado pelos clientes para simular os asteroides
+        self.last_checksum_tick = 0
+        self.overrun_ticks = 0 # ticks executados atrasados
+        self.skipped_ticks = 0 # ticks descartados por atraso maior que MAX_CATCHUP_TICKS
+        self.history = StateHistory(self.HISTORY_TICKS)
+        self.destroyed = set() # ids das naves destruídas
+        self.departed = {} # naves de clientes desconectados, devolvidas caso reconectem com o mesmo id
+        self.tokens = {} # token de reconexão de cada id, enviado apenas ao player dono do id no handshake
+        self.rejected_shots = {} # disparos recusados por id, para não avisar no console a cada mensagem
+        self.ready = set() # ids dos players prontos no lobby
+        self.started = False
+        self.start_event = Event() # sinalizado quando todos os players ficam prontos
+        self.random = random.Random() # gera as seeds dos asteroides
+        self.next_asteroid_id = 1
         self._clear() 
         ## a consertar: servidor quebra caso tenha muitos asteroides no mapa
         # self.asteroids= [Asteroid((0,0),1), Asteroid((100,100),2), Asteroid((100,100),3), Asteroid((100,10),4),
@@ -35,42 +76,129 @@ class Server:
         # Asteroid((0,0),1123), Asteroid((100,100),232), Asteroid((100,100),32345), Asteroid((100,10),5644),
         # Asteroid((0,0),12), Asteroid((100,100),122), Asteroid((100,100),33445), Asteroid((100,10),4565784),
         # Asteroid((0,0),321), Asteroid((100,100),1412), Asteroid((100,100),2233), Asteroid((100,10),567574)]
-        self.asteroids=[Asteroid((0,0),1), Asteroid((100,100),2)]
+        self._spawn_asteroid((to_fixed(0), to_fixed(0)))
+        self._spawn_asteroid((to_fixed(100), to_fixed(100)))
 
     # inicia o jogo
     def run(self):
-        self._create_connection() # cria a conexão do server e aguarda os clientes conectarem
-        self._create_lobby() # cria o lobby da partida e aguarda os jogadores estarem prontos
-        self._create_listeners() # cria um listener para cada cliente conectado, cada listener é uma thread
+        self._create_connection() # cria a conexão do server, players e espectadores são aceitos numa thread durante toda a partida
+        self._create_lobby() # aguarda a sala encher e os jogadores estarem prontos
         #self._create_broadcaster() # não testado totalmente, descomentar essa linha faz o broadcast do jogo ser feito numa thread dedicada. lag artificial só funciona desse modo
-        time.sleep(0.2)
         #self._spawn_asteroids() # não testado, thread que cria asteroides
         self._loop()
 
+    # agenda os ticks e os snapshots pelo relógio monotônico, cada um na sua taxa
     def _loop(self):
+        next_tick = time.monotonic()
+        next_snapshot = next_tick
         while True:
-            self._game()
+            now = time.monotonic()
+            wait = min(next_tick, next_snapshot) - now
+            if wait > 0:
+                time.sleep(wait)
+                now = time.monotonic()
+
+            # executa os ticks atrasados, até MAX_CATCHUP_TICKS por vez
+            ticks = 0
+            while now >= next_tick and ticks < self.MAX_CATCHUP_TICKS:
+                self._game()
+                next_tick += 1 / self.tick_rate
+                ticks += 1
+            if ticks > 1:
+                self.overrun_ticks += ticks - 1
+            # atraso grande demais, descarta os ticks restantes em vez de acelerar o jogo
+            if now >= next_tick:
+                skipped = int((now - next_tick) * self.tick_rate) + 1
+                self.skipped_ticks += skipped
+                next_tick += skipped / self.tick_rate
+                print("Server: simulação atrasada, "+str(skipped)+" ticks descartados")
+
+            if now >= next_snapshot:
+                self._broadcast_game() # anuncia o jogo para os clientes. comentar essa linha caso descomente a do broadcaster
+                next_snapshot = max(next_snapshot + 1 / self.snapshot_rate, now)
+
+    # altera a taxa de snapshots durante o jogo, troca banda e processamento por suavidade.
+    # chamado pelo cliente que criou a sessão (F5/F6), limitado entre 1 e a taxa da simulação
+    def set_snapshot_rate(self, snapshot_rate):
+        self.snapshot_rate = max(1, min(snapshot_rate, self.tick_rate))
+        print("Server: taxa de snapshots alterada para "+str(self.snapshot_rate)+"/s")
 
     # limpa dados do jogo, referente a partida
     def _clear(self):
         self.bullets = []
+        self.shots = [] # disparos de cada cliente, id da bala -> [tick, origem, velocidade, tick em que saiu do mapa]
         self.asteroids = []
         self.spaceships = [] # no caso do server, guarda as informaçoes referentes a todas as naves
 
     # server cuida da lógica dos asteroides e o andamento da partida
     def _game(self):
-        self.clock.tick(self.tick_rate)
         self.lock.acquire()
+        self.tick += 1
+        for asteroid in self.asteroids:
+            asteroid.move(self.size, self.tick)
         for game_object in self._get_game_objects():
-            game_object.move(self.size)
+            if not isinstance(game_object, AsteroidState):
+                game_object.move(self.size, self.frame_scale)
+        self._prune_bullets()
+        self.history.record(self.tick, self.asteroids, self.spaceships)
         self.lock.release()
-        self._broadcast_game() # anuncia o jogo para os clientes. comentar essa linha caso descomente a 45
+
+    # balas que saem do mapa deixam de ser enviadas, mas o disparo é guardado enquanto
+    # um acerto anterior à saída ainda puder ser validado pelo histórico
+    def _prune_bullets(self):
+        for index, bullets in enumerate(self.bullets):
+            shots = self.shots[index]
+            kept = []
+            for bullet in bullets:
+                x, y = bullet.position
+                if 0 <= x <= self.size.x and 0 <= y <= self.size.y:
+                    kept.append(bullet)
+                elif bullet.id in shots:
+                    shots[bullet.id][3] = self.tick
+            self.bullets[index] = kept
+            for bullet_id in [bullet_id for bullet_id, shot in shots.items() if shot[3] is not None and shot[3] < self.tick - self.HISTORY_TICKS]:
+                del shots[bullet_id]
 
     def _get_game_objects(self):
         bullets = [bullet for cl_bullets in self.bullets for bullet in cl_bullets]
         game_objects = [*self.asteroids, *bullets, *self.spaceships]
         return game_objects
 
+    # cria um asteroide e avisa os clientes, que passam a simulá-lo a partir da seed
+    # deve ser chamado com o lock adquirido
+    def _spawn_asteroid(self, fixed_position, size = 3):
+        asteroid = AsteroidState.from_record([self._new_asteroid_id(), self.random.getrandbits(32), self.tick, size, *fixed_position], self.tick_rate)
+        self._add_asteroid(asteroid)
+        return asteroid
+
+    # remove um asteroide abatido e cria seus filhos, deve ser chamado com o lock adquirido
+    def _split_asteroid(self, asteroid):
+        self.asteroids.remove(asteroid)
+        self._queue_asteroid_event(["destroy", asteroid.id, self.tick])
+        ids = [self._new_asteroid_id(), self._new_asteroid_id()]
+        seeds = [self.random.getrandbits(32), self.random.getrandbits(32)]
+        ret = asteroid.split(self.tick, self.size, ids, seeds)
+        if (ret != False):
+            for new_asteroid in ret:
+                self._add_asteroid(new_asteroid)
+
+    def _add_asteroid(self, asteroid):
+        self.asteroids.append(asteroid)
+        self._queue_asteroid_event(["spawn", asteroid.record()])
+
+    def _new_asteroid_id(self):
+        self.next_asteroid_id += 1
+        return self.next_asteroid_id - 1
+
+    def _queue_asteroid_event(self, event):
+        for client in self.clients:
+            client.asteroid_events.append(event)
+        self.spectator_events.append(event)
+
+    # estado completo dos asteroides, enviado quando um cliente conecta ou pede resync
+    def _asteroid_reset_event(self):
+        return ["reset", [asteroid.record() for asteroid in self.asteroids]]
+
     def _spawn_asteroids(self):
         spawner_thread = Thread(target=self._spawner)
         spawner_thread.setName("Server: Spawner")
@@ -84,12 +212,12 @@ class Server:
                 while not_done:
                     pos = get_random_position(self.size)
                     for spaceship in self.spaceships:
-                        if abs(pos.x - spaceship.position.x) + abs(pos.y - spaceship.position.y) < self.dist_buffer:
+                        if abs(pos.x - spaceship.position[0]) + abs(pos.y - spaceship.position[1]) < self.dist_buffer:
                             break
                         else:
                             not_done = False
                             self.lock.acquire()
-                            self.asteroids.append(Asteroid(pos))
+                            self._spawn_asteroid((to_fixed(pos.x), to_fixed(pos.y)))
                             self.lock.release()             
                 
 
@@ -102,134 +230,429 @@ class Server:
     # envia dados do jogo para os clientes
     def _broadcaster(self):
         while True:
-            time.sleep(self.lag)
-            self.clock.tick(self.tick_rate)
-            for client in self.clients:
-                spaceships = []
-                self.lock.acquire()
-                for spaceship in self.spaceships:
-                    if spaceship.id != client.id:
-                        spaceships.append(spaceship)
-                
-                bullets = self.bullets[:client.id-1] + self.bullets[client.id:]
-                # instancia um objeto ServerData, que será usado para transportar dados pelo socket
-                asteroids = self.asteroids
-                self.lock.release()
-
-                server_data = ServerData(spaceships, [x for xs in bullets for x in xs], asteroids)
-                
-                try:
-                    client.connection.send(pickle.dumps(server_data))
-                except:
-                    pass
+            time.sleep(self.lag + 1 / self.snapshot_rate)
+            self._send_snapshots()
 
     def _broadcast_game(self):
         time.sleep(self.lag)
+        self._send_snapshots()
+
+    # os snapshots vão para a fila de cada cliente e são escritos sem bloquear,
+    # assim um cliente lento não atrasa o tick dos outros
+    def _send_snapshots(self):
+        snapshots, spectator_data, reset_event = self._build_snapshots()
+        for client, server_data in snapshots:
+            client.enqueue(server_data)
+        # espectadores custam uma única serialização por snapshot, independente de quantos sejam
+        if spectator_data is not None:
+            self.spectators.broadcast(spectator_data, reset_event)
+        for client in self.clients[:]:
+            if not client.flush():
+                self._disconnect(client, "conexão perdida")
+            elif client.is_too_slow():
+                self._disconnect(client, "muito lento")
+
+    # monta o ServerData de cada cliente. o checksum e os eventos de asteroides são lidos sob o mesmo lock,
+    # para o checksum corresponder exatamente aos eventos entregues junto
+    def _build_snapshots(self):
+        snapshots = []
+        self.lock.acquire()
+        checksum = None
+        if self.tick - self.last_checksum_tick >= self.CHECKSUM_INTERVAL:
+            checksum = [self.tick, asteroid_checksum(self.asteroids, self.tick, self.size)]
+            self.last_checksum_tick = self.tick
         for client in self.clients:
+            if not client.wants_snapshot(self.tick):
+                continue
             spaceships = []
-            self.lock.acquire()
             for spaceship in self.spaceships:
                 if spaceship.id != client.id:
                     spaceships.append(spaceship)
-            
+
             bullets = self.bullets[:client.id-1] + self.bullets[client.id:]
             # instancia um objeto ServerData, que será usado para transportar dados pelo socket
-            asteroids = self.asteroids
-            self.lock.release()
-
-            server_data = ServerData(spaceships, [x for xs in bullets for x in xs], asteroids)
-            
-            try:
-                client.connection.send(pickle.dumps(server_data))
-            except:
-                pass
+            asteroid_events, client.asteroid_events = client.asteroid_events, []
+            server_data = ServerData(self.tick, spaceships, [x for xs in bullets for x in xs], asteroid_events, checksum)
+            snapshots.append((client, server_data))
+        # espectadores veem todas as naves e balas
+        spectator_events, self.spectator_events = self.spectator_events, []
+        spectator_data, reset_event = None, None
+        if self.spectators.spectators:
+            bullets = [bullet for cl_bullets in self.bullets for bullet in cl_bullets]
+            spectator_data = ServerData(self.tick, self.spaceships, bullets, spectator_events, checksum)
+            if self.spectators.needs_reset():
+                reset_event = self._asteroid_reset_event()
+        self.lock.release()
+        return snapshots, spectator_data, reset_event
 
-    # cria a conexão do server e aguarda os clientes conectarem
+    # cria a conexão do server e a thread que aceita players e espectadores
     def _create_connection(self):
-        # cria os sockets necessários
-        server = create_socket(self.ip_address, self.port, self.qtd_players)
-
-        while len(self.clients) != self.qtd_players:
-            # aguarda a conexão de um player e aceita
-            game_data_connection, addr = server.accept()
-            # id atribuído para o cliente conectado
-            client_id = len(self.clients) + 1
-            client = ServerClient(client_id, game_data_connection)
-            # guarda referência dessa conexão
-            self.clients.append(client)
-            print("Server: cliente id "+str(client_id)+ ", endereço " + str(addr[0])+":"+ str(addr[1]) + " conectado")
-
-            # cria um spaceship vinculado a esse cliente via seu ID
-            pos = Vector2(self.size.x / 2 + self.size.x/15*client_id, self.size.y / 2)
-            if (client_id - 1 <= len(self.COLORS)):
-                color = self.COLORS[client_id-1]
-            else: color = (100,100,100)
-            spaceship = Spaceship(pos, client_id, color)
+        self.server_socket = create_socket(self.ip_address, self.port, self.qtd_players)
+        acceptor_thread = Thread(target=self._acceptor)
+        acceptor_thread.setName("Server: Conexões")
+        acceptor_thread.start()
+        listener_thread = Thread(target=self.spectators.listen)
+        listener_thread.setName("Listener server - espectadores")
+        listener_thread.start()
+
+    # cada conexão tem seu handshake numa thread curta, assim uma conexão que não envia nada
+    # não atrasa a entrada dos outros players e espectadores
+    def _acceptor(self):
+        while True:
+            connection, addr = self.server_socket.accept()
+            handshake_thread = Thread(target=self._handshake, args=(connection, addr))
+            handshake_thread.setName("Server: Handshake "+str(addr[0])+":"+str(addr[1]))
+            handshake_thread.start()
+
+    # a primeira mensagem informa se a conexão é de um espectador, de um player novo ("player")
+    # ou de um player reconectando (["player", id, token])
+    def _handshake(self, connection, addr):
+        try:
+            connection.settimeout(5)
+            reader = MessageReader(connection)
+            hello = reader.wait()
+            if hello == "spectator":
+                connection.settimeout(None)
+                self._add_spectator(connection, reader, addr)
+            elif hello == "player" or (isinstance(hello, list) and hello[:1] == ["player"]):
+                client_id, token = hello[1:3] if isinstance(hello, list) and len(hello) == 3 else (None, None)
+                if not self._add_player(connection, reader, addr, client_id, token):
+                    print("Server: sala cheia, conexão " + str(addr[0])+":"+ str(addr[1]) + " recusada")
+                    connection.close()
+            else:
+                connection.close()
+        except OSError:
+            connection.close()
+
+    # adiciona um player ao lobby ou, com a partida em andamento, como entrada tardia ou reconexão.
+    # quem entra depois do início recebe o estado completo: todos os asteroides (reset) e as naves no próximo snapshot
+    # a reconexão só é aceita com o token recebido no handshake, e a sala nunca passa de qtd_players.
+    # o listener pode ainda não ter percebido que o socket antigo caiu: com o token certo, a conexão nova substitui a antiga
+    def _add_player(self, connection, reader, addr, client_id = None, token = None):
+        self.lock.acquire()
+        stale = [client for client in self.clients if client.id == client_id and token is not None and self.tokens.get(client_id) == token]
+        self.lock.release()
+        for client in stale:
+            self._disconnect(client, "substituído pela reconexão")
+
+        self.lock.acquire()
+        connected_ids = [client.id for client in self.clients]
+        reconnect = isinstance(client_id, int) and client_id not in connected_ids and token is not None and self.tokens.get(client_id) == token
+        if len(self.clients) >= self.qtd_players:
+            self.lock.release()
+            return False
+        if not reconnect:
+            client_id = self._free_client_id(connected_ids)
+            self.tokens[client_id] = uuid.uuid4().hex
+        spaceship = self.departed.pop(client_id, None) or self._new_spaceship(client_id)
+
+        # informa o id, posiçao e cor para o cliente construir seu spaceship, e a taxa da simulação para simular os asteroides.
+        # a mensagem é pequena, então o envio com o lock não atrasa a simulação
+        try:
+            connection.settimeout(None)
+            send_message(connection, [client_id, spaceship.position, spaceship.color, self.tick_rate, self.tokens[client_id]])
+            if self.started:
+                send_message(connection, "start")
+            # daqui em diante os envios passam pela fila do cliente, sem bloquear
+            connection.setblocking(False)
+        except OSError:
+            self.departed[client_id] = spaceship
+            self.lock.release()
+            return False
+        client = ServerClient(client_id, connection, reader)
+        client.asteroid_events.append(self._asteroid_reset_event())
+        self.clients.append(client)
+        if client_id not in self.destroyed:
             self.spaceships.append(spaceship)
-            self.bullets.append([])
+        self.lock.release()
 
-            # informa o id, posiçao inicial e cor para o cliente conectado construir seu spaceship
-            client.connection.send(pickle.dumps([client_id, pos, color]))
-            time.sleep(1)
-            for cl in self.clients:
-                cl.connection.send(pickle.dumps([len(self.clients),self.qtd_players]))
+        status = "reconectado" if reconnect else "conectado"
+        print("Server: cliente id "+str(client_id)+ ", endereço " + str(addr[0])+":"+ str(addr[1]) + " " + status)
+        self._create_listener(client)
+        self._lobby_changed()
+        return True
+
+    # id atribuído para um player novo, também é o índice de suas balas e disparos.
+    # reaproveita o menor id livre, assim as cores e as posições iniciais continuam dentro de COLORS e da tela.
+    # o id passa a ser do novo player: o dono anterior não reconecta mais e sua nave é descartada
+    def _free_client_id(self, connected_ids):
+        for client_id in range(1, len(self.bullets) + 1):
+            if client_id not in connected_ids:
+                self.departed.pop(client_id, None)
+                self.destroyed.discard(client_id)
+                self.rejected_shots.pop(client_id, None)
+                self.bullets[client_id-1] = []
+                self.shots[client_id-1] = {}
+                return client_id
+        self.bullets.append([])
+        self.shots.append({})
+        return len(self.bullets)
+
+    # nave inicial de um player, vinculada a ele via seu ID
+    def _new_spaceship(self, client_id):
+        pos = (self.size.x / 2 + self.size.x/15*client_id, self.size.y / 2)
+        if client_id - 1 < len(self.COLORS):
+            color = self.COLORS[client_id-1]
+        else: color = (100,100,100)
+        return ShipState(client_id, pos, (0, 0), (0, -1), color)
+
+    # espectadores recebem a taxa da simulação, para simular os asteroides
+    def _add_spectator(self, connection, reader, addr):
+        send_message(connection, ["spectator", self.tick_rate])
+        self.spectators.add(ServerClient(0, connection, reader))
+        print("Server: espectador " + str(addr[0])+":"+ str(addr[1]) + " conectado")
+
+    # avisa os players do lobby sempre que alguém entra, sai ou fica pronto, e inicia a partida quando todos estiverem prontos.
+    # as mensagens vão para a fila de cada cliente e são escritas sem bloquear, um cliente que parou de ler
+    # não atrasa os outros. o que não couber no socket é escrito no próximo flush (próxima mudança ou o loop da partida)
+    def _lobby_changed(self):
+        self.lock.acquire()
+        if self.started:
+            self.lock.release()
+            return
+        roster = ["roster", len(self.clients), self.qtd_players, len(self.ready)]
+        start = len(self.clients) == self.qtd_players and all(client.id in self.ready for client in self.clients)
+        for client in self.clients:
+            client.send_control(roster)
+            if start:
+                client.send_control("start")
+            client.flush() # desconexões são detectadas pelo listener do cliente
+        self.started = start
+        self.lock.release()
+        if start:
+            self.start_event.set()
+
+    def _set_ready(self, client):
+        self.lock.acquire()
+        self.ready.add(client.id)
+        self.lock.release()
+        self._lobby_changed()
 
     # recebe informaçoes de cada cliente
     def _client_listener(self, client):
-        while True:
+        while client.connected:
             try:
-                load = client.connection.recv(2048)
-                self.lock.acquire()
-                cl_spaceship, cl_bullets, hit_asteroids, game_over = self._unpack_client_data(pickle.loads(load), client.id)
-                # deleta todas as balas atiradas por esse spaceship e preenche novamente com os dados recebidos agora, para deletar balas nao usadas mais
-                bullets = []
-                for cl_bullet in cl_bullets:
-                    bullets.append(Bullet(cl_bullet[1], cl_bullet[0], client.id, cl_bullet[3], cl_bullet[2]))
-                self.bullets[client.id-1] = bullets
-                # atualiza dados do spaceship no server
-                for spaceship in self.spaceships:
-                    if spaceship.id == client.id:
-                        spaceship.velocity = cl_spaceship[0]
-                        spaceship.position = cl_spaceship[1]
-                        spaceship.direction = cl_spaceship[2]
-                # divide asteroides abatidos
-                for asteroid in hit_asteroids:
-                    #print("hit", asteroid.id)
-                    ret = asteroid.split()
-                    if (ret != False):
-                        asteroid1, asteroid2 = ret
-                        #print("new1: ", asteroid1.id)
-                        #print("new2: ", asteroid2.id)
-                        self.asteroids.append(asteroid1)
-                        self.asteroids.append(asteroid2)
-                    self.asteroids.remove(asteroid)
-                self.lock.release()
-            except:
-                pass
-
-    # cria um listener para cada cliente conectado, cada listener é uma thread
-    def _create_listeners(self):
-        for client in self.clients:
-            client_thread = Thread(target=self._client_listener, args=(client,))
-            client_thread.setName("Listener server - cliente "+str(client.id))
-            client_thread.start()
+                # o socket não bloqueia por causa dos envios, então aguarda dados com select
+                readable, _, _ = select.select([client.connection], [], [], 0.5)
+                if not readable:
+                    continue
+                client_data = client.reader.poll()
+                while client_data is not None:
+                    if client_data == "ready":
+                        self._set_ready(client)
+                    else:
+                        self._handle_client_data(client, client_data)
+                    client_data = client.reader.poll()
+            except (OSError, ValueError):
+                self._disconnect(client, "conexão perdida")
+            except Exception:
+                # erro ao tratar a mensagem: registra e desconecta, em vez de repetir o mesmo estado em silêncio
+                print("Server: erro ao tratar mensagem do cliente id "+str(client.id))
+                traceback.print_exc()
+                self._disconnect(client, "mensagem inválida")
+
+    # o lock é liberado mesmo se a mensagem gerar uma exceção, senão a simulação de todos os players trava
+    def _handle_client_data(self, client, client_data):
+        if not self._valid_client_data(client_data):
+            return
+        with self.lock:
+            if client.id in self.destroyed:
+                return
+            # atualiza dados do spaceship no server
+            cl_spaceship = ShipState.unpack(client_data.spaceship)
+            for spaceship in self.spaceships:
+                if spaceship.id == client.id:
+                    spaceship.velocity = cl_spaceship.velocity
+                    spaceship.position = cl_spaceship.position
+                    spaceship.direction = cl_spaceship.direction
+            # balas são recebidas apenas quando disparadas, depois o server as simula
+            claimed = {claim[0] for claim in client_data.hit_claims}
+            for shot in client_data.shots:
+                self._add_shot(client.id, shot, client_data.ack_tick, claimed)
+            # divide asteroides abatidos, após validar cada acerto no tick visto pelo cliente
+            for asteroid, bullet_id in self._validate_hits(client.id, client_data.hit_claims, client_data.ack_tick):
+                self._split_asteroid(asteroid)
+            # o cliente já removeu as balas dos pedidos, aceitos ou não. mantê-las contaria balas fantasmas em MAX_BULLETS
+            for bullet_id in claimed:
+                self._remove_bullet(client.id, bullet_id)
+            if client_data.game_over_tick is not None and self._validate_game_over(cl_spaceship, client_data.game_over_tick, client_data.ack_tick):
+                self._destroy_spaceship(client.id)
+            # cliente detectou dessincronização, reenvia todos os asteroides
+            if client_data.resync:
+                client.asteroid_events = [self._asteroid_reset_event()]
+
+    # mensagens com a nave, disparos ou pedidos malformados são descartadas inteiras, antes de desempacotar qualquer campo
+    def _valid_client_data(self, client_data):
+        spaceship = client_data.spaceship
+        if not (_is_records([spaceship], 5) and all(_is_point(vector) for vector in spaceship[1:4])):
+            return False
+        if not (_is_records(client_data.shots, 5) and _is_records(client_data.hit_claims, 3) and _is_number(client_data.ack_tick)):
+            return False
+        if client_data.game_over_tick is not None and not _is_number(client_data.game_over_tick):
+            return False
+        for bullet_id, origin, velocity, color, fire_tick in client_data.shots:
+            if not (isinstance(bullet_id, int) and _is_point(origin) and _is_point(velocity) and _is_number(fire_tick)):
+                return False
+        for bullet_id, asteroid_id, claim_tick in client_data.hit_claims:
+            if not (isinstance(bullet_id, int) and isinstance(asteroid_id, int) and _is_number(claim_tick)):
+                return False
+        return True
+
+    # o tick do disparo é limitado ao intervalo que o cliente pode ter visto.
+    # disparos que não batem com a nave do server nesse tick são descartados, a cor é sempre a da nave
+    def _add_shot(self, client_id, shot, ack_tick, claimed):
+        bullet_id, origin, velocity, _, fire_tick = shot
+        fire_tick = min(max(fire_tick, ack_tick - 1), self.tick)
+        spaceship = next((spaceship for spaceship in self.spaceships if spaceship.id == client_id), None)
+        if spaceship is None or bullet_id in self.shots[client_id-1] or not self._valid_shot(client_id, origin, velocity, fire_tick, ack_tick, claimed):
+            self._log_rejected_shot(client_id)
+            return
+        self.shots[client_id-1][bullet_id] = [fire_tick, origin, velocity, None]
+        position = self._bullet_position_at(self.shots[client_id-1][bullet_id], self.tick)
+        self.bullets[client_id-1].append(BulletState(bullet_id, position, velocity, spaceship.color))
+
+    # avisa no primeiro disparo recusado de cada cliente e depois a cada REJECTED_SHOTS_LOG
+    def _log_rejected_shot(self, client_id):
+        count = self.rejected_shots.get(client_id, 0) + 1
+        self.rejected_shots[client_id] = count
+        if count == 1 or count % self.REJECTED_SHOTS_LOG == 0:
+            print("Server: "+str(count)+" disparo(s) inválido(s) do cliente id "+str(client_id)+" descartado(s)")
+
+    # a origem tem que estar junto da nave no tick do disparo, a velocidade relativa à nave tem que ser a de uma bala
+    # e o cliente não pode ter mais que MAX_BULLETS balas no mapa.
+    # a nave do server é a última informada pelo cliente, atrasada no máximo pela ida e volta até ele,
+    # então as tolerâncias crescem com o quanto a nave pode ter andado e acelerado nesse intervalo
+    def _valid_shot(self, client_id, origin, velocity, fire_tick, ack_tick, claimed):
+        ships = self.history.ships_at(int(fire_tick))
+        if ships is None or client_id not in ships:
+            return False
+        x, y, vx, vy = ships[client_id]
+        lag_ticks = min(max(self.tick - ack_tick, 0) + 1, self.MAX_EXTRAPOLATION_TICKS)
 
+        offset_x, offset_y = Spaceship.BULLET_OFFSET
+        dx = _wrap_delta(origin[0] - offset_x - x, self.size.x)
+        dy = _wrap_delta(origin[1] - offset_y - y, self.size.y)
+        if math.hypot(dx, dy) > self.HIT_TOLERANCE + Spaceship.MAX_SPEED * self.frame_scale * lag_ticks:
+            return False
+
+        speed_drift = min(Spaceship.ACCELERATION * self.frame_scale * lag_ticks, 2 * Spaceship.MAX_SPEED)
+        relative_speed = math.hypot(velocity[0] - vx, velocity[1] - vy)
+        if abs(relative_speed - Spaceship.BULLET_SPEED) > self.SHOT_SPEED_TOLERANCE + speed_drift:
+            return False
+
+        # balas ainda no mapa no tick do disparo, sem contar as que acertaram algo nessa mesma mensagem
+        live = 0
+        for bullet_id, shot in self.shots[client_id-1].items():
+            if bullet_id in claimed:
+                continue
+            bullet_x, bullet_y = self._bullet_position_at(shot, fire_tick)
+            if 0 <= bullet_x <= self.size.x and 0 <= bullet_y <= self.size.y:
+                live += 1
+        return live < Spaceship.MAX_BULLETS
+
+    def _remove_bullet(self, client_id, bullet_id):
+        self.shots[client_id-1].pop(bullet_id, None)
+        self.bullets[client_id-1] = [bullet for bullet in self.bullets[client_id-1] if bullet.id != bullet_id]
+
+    def _bullet_position_at(self, shot, tick):
+        fire_tick, origin, velocity, _ = shot
+        return Bullet.position_at(origin, velocity, fire_tick, tick, self.frame_scale)
+
+    # tick para o qual o server volta ao validar um pedido do cliente, ou None se estiver fora do intervalo aceito.
+    # o tick continua fracionado, como o cliente viu, sem arredondar
+    def _rewind_tick(self, claim_tick, ack_tick):
+        tick = min(claim_tick, self.tick)
+        if tick < ack_tick - 1 or tick > ack_tick + self.MAX_EXTRAPOLATION_TICKS:
+            return None
+        return tick
+
+    # asteroides existentes no tick, id -> (x, y, raio). os que continuam vivos são calculados no tick exato
+    # (fracionado) com a mesma fórmula do cliente, os já destruídos ficam com a posição do histórico
+    def _asteroids_at(self, tick):
+        asteroids = self.history.at(int(tick))
+        if asteroids is None:
+            return None
+        positions = dict(asteroids)
+        for asteroid in self.asteroids:
+            if asteroid.id in positions:
+                x, y = asteroid.fixed_position_at(tick, self.size)
+                positions[asteroid.id] = (from_fixed(x), from_fixed(y), asteroid.radius)
+        return positions
+
+    # valida os acertos em lote, agrupados por tick para consultar o histórico uma vez por tick
+    def _validate_hits(self, client_id, hit_claims, ack_tick):
+        shots = self.shots[client_id-1]
+        alive = {asteroid.id: asteroid for asteroid in self.asteroids}
+        claims_by_tick = {}
+        for bullet_id, asteroid_id, claim_tick in hit_claims:
+            tick = self._rewind_tick(claim_tick, ack_tick)
+            if tick is not None:
+                claims_by_tick.setdefault(tick, []).append((bullet_id, asteroid_id))
+
+        hits = []
+        used_bullets = set()
+        for tick, claims in claims_by_tick.items():
+            asteroids = self._asteroids_at(tick)
+            if asteroids is None:
+                continue
+            for bullet_id, asteroid_id in claims:
+                # asteroide já destruído (por outro player ou outra bala) ou bala desconhecida
+                if asteroid_id not in alive or asteroid_id not in asteroids or bullet_id not in shots or bullet_id in used_bullets:
+                    continue
+                x, y, radius = asteroids[asteroid_id]
+                bullet_x, bullet_y = self._bullet_position_at(shots[bullet_id], tick)
+                if math.hypot(x - bullet_x, y - bullet_y) < radius + Bullet.RADIUS + self.HIT_TOLERANCE:
+                    hits.append((alive.pop(asteroid_id), bullet_id))
+                    used_bullets.add(bullet_id)
+        return hits
+
+    # a posição da nave é a informada pelo cliente, os asteroides são os do histórico no tick da colisão
+    def _validate_game_over(self, cl_spaceship, claim_tick, ack_tick):
+        tick = self._rewind_tick(claim_tick, ack_tick)
+        asteroids = self._asteroids_at(tick) if tick is not None else None
+        if asteroids is None:
+            return False
+        spaceship_x, spaceship_y = cl_spaceship.position
+        for x, y, radius in asteroids.values():
+            if math.hypot(x - spaceship_x, y - spaceship_y) < radius + Spaceship.RADIUS + self.HIT_TOLERANCE:
+                return True
+        return False
+
+    def _destroy_spaceship(self, client_id):
+        self.destroyed.add(client_id)
+        self.spaceships = [spaceship for spaceship in self.spaceships if spaceship.id != client_id]
+        print("Server: nave do cliente id "+str(client_id)+" destruída")
+
+    # remove o cliente da partida, junto com sua nave e suas balas
+    def _disconnect(self, client, reason):
+        self.lock.acquire()
+        if not client.connected:
+            self.lock.release()
+            return
+        client.connected = False
+        self.clients.remove(client)
+        self.ready.discard(client.id)
+        for spaceship in self.spaceships:
+            if spaceship.id == client.id:
+                self.departed[client.id] = spaceship
+        self.spaceships = [spaceship for spaceship in self.spaceships if spaceship.id != client.id]
+        self.bullets[client.id-1] = []
+        self.shots[client.id-1] = {}
+        self.lock.release()
+        try:
+            client.connection.close()
+        except:
+            pass
+        print("Server: cliente id "+str(client.id)+" desconectado ("+reason+")")
+        self._lobby_changed()
+
+    # cada cliente tem um listener próprio desde que entra no lobby, cada listener é uma thread
+    def _create_listener(self, client):
+        client_thread = Thread(target=self._client_listener, args=(client,))
+        client_thread.setName("Listener server - cliente "+str(client.id))
+        client_thread.start()
+
+    # aguarda, sem polling, a mensagem de início enviada quando todos estiverem prontos
     def _create_lobby(self):
-        # a sala está cheia, aguarda input de pronto dos clientes
-        for client in self.clients:
-            pickle.loads(client.connection.recv(2048))
-        # envia confirmação para clientes
-        for client in self.clients:
-            client.connection.send(pickle.dumps(True))
-
-    # carrega dados vindo do cliente
-    def _unpack_client_data(self, client_data : ClientData, id):
-        hit_asteroids = []
-        for hit_asteroid_id in client_data.hit_asteroids:
-            for asteroid in self.asteroids:
-                if asteroid.id == hit_asteroid_id:
-                    #print("hit", str(asteroid.id))
-                    hit_asteroids.append(asteroid)
-                    break
-        #if len(hit_asteroids) > 0: print(str(hit_asteroids))
-        return client_data.spaceship, client_data.bullets, hit_asteroids, client_data.game_over
\ No newline at end of file
+        self.start_event.wait()
+        print("Server: partida iniciada com "+str(len(self.clients))+" jogadores")
@@ -0,0 +1,50 @@
+# fila de saída por cliente e desconexão de clientes lentos (user-027)
+import socket
+from models import ServerClient, ServerData, ShipState
+
+def make_client():
+    server_end, client_end = socket.socketpair()
+    server_end.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    server_end.setblocking(False)
+    client_end.setblocking(False)
+    return ServerClient(1, server_end), client_end
+
+def snapshot(tick, asteroid_events = ()):
+    spaceships = [ShipState(id, (id, id), (0, 0), (0, -1), (224,224,224)) for id in range(200)]
+    return ServerData(tick, spaceships, [], list(asteroid_events))
+
+# server a 60 ticks e 30 snapshots por segundo, retorna o tick em que o cliente foi desconectado ou None
+def run(client, ticks, reader = None):
+    for tick in range(1, ticks):
+        if reader is not None:
+            try:
+                while reader.recv(65536):
+                    pass
+            except BlockingIOError:
+                pass
+        if tick % 2 == 0 and client.wants_snapshot(tick):
+            client.enqueue(snapshot(tick))
+        if not client.flush() or client.is_too_slow():
+            return tick
+    return None
+
+def test_dropped_snapshot_keeps_asteroid_events():
+    client, _ = make_client()
+    client.enqueue(snapshot(1, [["spawn", [1]]]))
+    client.enqueue(snapshot(2, [["destroy", 1, 2]]))
+    assert len(client.pending) == ServerClient.MAX_PENDING
+    assert client.pending[0].tick == 2
+    assert client.pending[0].asteroid_events == [["spawn", [1]], ["destroy", 1, 2]]
+
+def test_stalled_client_is_disconnected_in_bounded_ticks():
+    client, _ = make_client()
+    # intervalo dobra a cada janela até MAX_SNAPSHOT_INTERVAL (1 -> 8: 3 janelas), depois MAX_LAG_WINDOWS janelas
+    limit = (3 + ServerClient.MAX_LAG_WINDOWS + 1) * ServerClient.LAG_WINDOW
+    disconnected = run(client, limit + ServerClient.LAG_WINDOW)
+    assert client.snapshot_interval == ServerClient.MAX_SNAPSHOT_INTERVAL
+    assert disconnected is not None and disconnected <= limit
+
+def test_reading_client_keeps_full_rate():
+    client, reader = make_client()
+    assert run(client, 10 * ServerClient.LAG_WINDOW, reader) is None
+    assert client.snapshot_interval == 1
@@ -0,0 +1,43 @@
+# simulação determinística dos asteroides em ponto fixo e checksum (user-026)
+import pickle
+from pygame.math import Vector2
+from models import AsteroidState
+from util import asteroid_checksum, to_fixed
+
+SIZE = Vector2(972, 756)
+
+def make_asteroids(tick_rate = 60):
+    return [AsteroidState(id, 3 - id % 3, seed, id * 7, (to_fixed(id * 37.5), to_fixed(id * 11.25)), tick_rate)
+            for id, seed in zip(range(1, 9), (17, 4242, 9001, 3, 77, 123456, 5, 31337))]
+
+# reconstrói os asteroides a partir dos registros enviados pela rede, como faz o cliente
+def from_network(asteroids, tick_rate = 60):
+    records = pickle.loads(pickle.dumps([asteroid.record() for asteroid in asteroids]))
+    return [AsteroidState.from_record(record, tick_rate) for record in records]
+
+def test_client_reconstruction_matches_server_exactly():
+    server_asteroids = make_asteroids()
+    client_asteroids = from_network(server_asteroids)
+    for tick in (56, 57, 1000, 123457):
+        for server_asteroid, client_asteroid in zip(server_asteroids, client_asteroids):
+            position = server_asteroid.fixed_position_at(tick, SIZE)
+            assert all(isinstance(value, int) for value in position)
+            assert position == client_asteroid.fixed_position_at(tick, SIZE)
+
+def test_split_children_are_identical_on_both_sides():
+    server_children = make_asteroids()[0].split(500, SIZE, [20, 21], [8, 9])
+    client_children = from_network(server_children)
+    assert server_children[0].spawn_position == make_asteroids()[0].fixed_position_at(500, SIZE)
+    for server_child, client_child in zip(server_children, client_children):
+        assert server_child.fixed_position_at(900, SIZE) == client_child.fixed_position_at(900, SIZE)
+
+def test_checksum_ignores_order_and_detects_desync():
+    asteroids = make_asteroids()
+    checksum = asteroid_checksum(asteroids, 1000, SIZE)
+    assert asteroid_checksum(from_network(asteroids)[::-1], 1000, SIZE) == checksum
+    assert asteroid_checksum(asteroids[1:], 1000, SIZE) != checksum
+    # uma unidade de ponto fixo (1/256 px) de diferença já é uma dessincronização
+    shifted = from_network(asteroids)
+    x, y = shifted[0].spawn_position
+    shifted[0].spawn_position = (x + 1, y)
+    assert asteroid_checksum(shifted, 1000, SIZE) != checksum
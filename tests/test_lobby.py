@@ -0,0 +1,64 @@
+# entrada no lobby e reconexão por token (user-034)
+import socket
+from pygame.math import Vector2
+from models import MessageReader
+from server import Server
+
+def make_server(qtd_players = 2):
+    return Server(Vector2(972, 756), qtd_players, 0)
+
+# player conectado por um socketpair, o socket do cliente deve ser mantido numa variável senão ele é fechado.
+# retorna o socket do lado do cliente e o handshake (None se recusado)
+def join(server, client_id = None, token = None):
+    server_end, client_end = socket.socketpair()
+    if not server._add_player(server_end, MessageReader(server_end), ("test", 0), client_id, token):
+        server_end.close()
+        return client_end, None
+    return client_end, MessageReader(client_end).wait()
+
+# encerra os listeners, que são threads sem daemon
+def close(server):
+    for client in list(server.clients):
+        server._disconnect(client, "fim do teste")
+
+def test_reconnect_with_token_replaces_stale_client():
+    server = make_server()
+    try:
+        first_end, first = join(server)
+        second_end, _ = join(server)
+        stale = server.clients[0]
+        # a sala está cheia e o socket antigo ainda não foi detectado como fechado
+        _, handshake = join(server, first[0], first[4])
+        assert handshake is not None and handshake[0] == first[0]
+        assert not stale.connected
+        assert sorted(client.id for client in server.clients) == [1, 2]
+    finally:
+        close(server)
+
+def test_reconnect_restores_departed_ship():
+    server = make_server()
+    try:
+        _, first = join(server)
+        server.spaceships[0].position = Vector2(10, 20)
+        server._disconnect(server.clients[0], "teste")
+        assert 1 in server.departed
+        _, handshake = join(server, first[0], first[4])
+        assert handshake[0] == 1 and tuple(handshake[1]) == (10, 20)
+        assert 1 not in server.departed
+    finally:
+        close(server)
+
+def test_wrong_token_does_not_take_the_id():
+    server = make_server()
+    try:
+        first_end, first = join(server)
+        second_end, _ = join(server)
+        _, handshake = join(server, first[0], "token errado")
+        assert handshake is None
+        assert server.clients[0].connected
+        server._disconnect(server.clients[1], "teste")
+        # com vaga livre, um token errado entra como player novo sem receber a nave do id pedido
+        _, handshake = join(server, 2, "token errado")
+        assert handshake is not None and handshake[4] != first[4]
+    finally:
+        close(server)
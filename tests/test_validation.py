@@ -0,0 +1,103 @@
+# validação de disparos e acertos no server (user-032)
+import pytest
+from pygame.math import Vector2
+from models import GameObject, Spaceship, AsteroidState, ClientData
+from server import Server
+from util import to_fixed, from_fixed
+
+SIZE = Vector2(972, 756)
+
+class FakeClient:
+    def __init__(self, id):
+        self.id = id
+
+def make_server(ticks = 10):
+    server = Server(SIZE, 1, 0)
+    server.bullets.append([])
+    server.shots.append({})
+    server.spaceships.append(server._new_spaceship(1))
+    for _ in range(ticks):
+        server._game()
+    return server
+
+# nave do cliente no mesmo lugar da nave do server, apontada para onde o asteroide vai estar quando a bala chegar
+def aim_at(server, asteroid, distance = 150):
+    ship_state = server.spaceships[0]
+    ax, ay = asteroid.position
+    ship_state.position = (ax + distance, ay)
+    for _ in range(2):
+        server._game()
+    spaceship = Spaceship(ship_state.position, 1, ship_state.color)
+    origin = spaceship.position + Vector2(Spaceship.BULLET_OFFSET)
+    travel_ticks = distance / (Spaceship.BULLET_SPEED * server.frame_scale)
+    x, y = asteroid.fixed_position_at(server.tick + travel_ticks, SIZE)
+    spaceship.direction = (Vector2(from_fixed(x), from_fixed(y)) - origin).normalize()
+    return spaceship
+
+def fire(spaceship, fire_tick):
+    bullets = []
+    spaceship.shoot(bullets.append, 0)
+    bullets[0].fire_tick = fire_tick
+    return bullets[0]
+
+# cliente honesto a um fps diferente de 120: o tick avança pelo tempo real de cada frame
+@pytest.mark.parametrize("fps", [62, 123, 240])
+def test_honest_hit_is_accepted_at_any_frame_rate(fps):
+    server = make_server()
+    # asteroide pequeno, o erro de uma bala fora do tick já faz o acerto ser recusado
+    target = server._spawn_asteroid((to_fixed(400), to_fixed(300)), size = 1)
+    server._game()
+    spaceship = aim_at(server, target)
+    asteroid = AsteroidState.from_record(target.record(), server.tick_rate)
+
+    fire_tick = server.tick - 0.6
+    bullet = fire(spaceship, fire_tick)
+    server._handle_client_data(FakeClient(1), ClientData(spaceship, [bullet], [], None, server.tick - 1))
+    assert len(server.bullets[0]) == 1
+
+    tick = fire_tick
+    claim = None
+    while claim is None and tick < fire_tick + server.HISTORY_TICKS:
+        tick += server.tick_rate / fps
+        asteroid.move(SIZE, tick)
+        bullet.move_to(tick, GameObject.REFERENCE_RATE / server.tick_rate)
+        if asteroid.collides_with(bullet):
+            claim = [bullet.id, asteroid.id, tick]
+    assert claim is not None
+    while server.tick < tick:
+        server._game()
+
+    server._handle_client_data(FakeClient(1), ClientData(spaceship, [], [claim], None, int(tick)))
+    assert target.id not in [a.id for a in server.asteroids]
+
+def test_forged_shot_is_rejected():
+    server = make_server()
+    target = server.asteroids[1]
+    spaceship = aim_at(server, target)
+    bullet = fire(spaceship, server.tick)
+    # bala parada em cima do asteroide, longe da nave
+    bullet.origin = target.position
+    bullet.velocity = Vector2(0, 0)
+    server._handle_client_data(FakeClient(1), ClientData(spaceship, [bullet], [[bullet.id, target.id, server.tick]], None, server.tick))
+    assert len(server.asteroids) == 2
+    assert server.bullets[0] == []
+
+def test_bullet_limit_and_rejected_claims_free_the_bullet():
+    server = make_server()
+    spaceship = aim_at(server, server.asteroids[1])
+    bullets = [fire(spaceship, server.tick) for _ in range(Spaceship.MAX_BULLETS + 1)]
+    server._handle_client_data(FakeClient(1), ClientData(spaceship, bullets, [], None, server.tick))
+    assert len(server.shots[0]) == Spaceship.MAX_BULLETS
+
+    # acerto recusado (asteroide inexistente), mas a bala já foi consumida pelo cliente
+    server._handle_client_data(FakeClient(1), ClientData(spaceship, [], [[bullets[0].id, -1, server.tick]], None, server.tick))
+    assert bullets[0].id not in server.shots[0]
+    extra = fire(spaceship, server.tick)
+    server._handle_client_data(FakeClient(1), ClientData(spaceship, [extra], [], None, server.tick))
+    assert extra.id in server.shots[0]
+
+def test_malformed_claim_does_not_hold_the_lock():
+    server = make_server()
+    spaceship = Spaceship(server.spaceships[0].position, 1, server.spaceships[0].color)
+    server._handle_client_data(FakeClient(1), ClientData(spaceship, [], [[1, 2]], None, server.tick))
+    assert not server.lock.locked()
@@ -1,12 +1,47 @@
+import json
+import os
+import pickle
 import random
 import socket
+import struct
+import zlib
 import pygame
 from pygame.math import Vector2
+from pygame.transform import rotozoom
 
 
-def load_sprite(char, size, font, trim_x = 0, trim_y = 0, color = (224,224,224)):
-    font = pygame.font.SysFont(font, int(size), bold=True)
-    sprite = font.render(char, True, color)
+# posições dos asteroides são simuladas em ponto fixo (1/256 px) para serem idênticas no server e nos clientes
+FIXED_SHIFT = 8
+FIXED_ONE = 1 << FIXED_SHIFT
+
+# cada mensagem do socket é prefixada com seu tamanho, para não depender de um recv por mensagem
+MESSAGE_HEADER = struct.Struct("!I")
+
+_atlas = {} # sprites pré-renderizados carregados de atlas.png, ver atlas.py
+_sprite_cache = {} # sprites renderizados com fonte durante a execução
+_fonts = {}
+
+# chave que identifica um sprite no atlas e no cache
+def sprite_key(char, size, font, trim_x = 0, trim_y = 0, color = (224,224,224), scale = 1):
+    return (char, int(size), font, float(trim_x), float(trim_y), tuple(color), float(scale))
+
+def load_sprite(char, size, font, trim_x = 0, trim_y = 0, color = (224,224,224), scale = 1):
+    key = sprite_key(char, size, font, trim_x, trim_y, color, scale)
+    sprite = _atlas.get(key)
+    if sprite is None:
+        sprite = _sprite_cache.get(key)
+    if sprite is None:
+        sprite = _compose_glyphs(key)
+    if sprite is None:
+        sprite = render_sprite(char, size, font, trim_x, trim_y, color, scale)
+    _sprite_cache[key] = sprite
+    return sprite
+
+# renderiza o sprite com a fonte do sistema, usado quando ele não está no atlas
+def render_sprite(char, size, font, trim_x = 0, trim_y = 0, color = (224,224,224), scale = 1):
+    if (font, int(size)) not in _fonts:
+        _fonts[(font, int(size))] = pygame.font.SysFont(font, int(size), bold=True)
+    sprite = _fonts[(font, int(size))].render(char, True, color)
 
     # corta sprite para colisão funcionar corretamente
     offset_x = sprite.get_width() - trim_x
@@ -15,8 +50,48 @@ def load_sprite(char, size, font, trim_x = 0, trim_y = 0, color = (224,224,224))
     surface.fill((0, 0, 0, 0))
     surface.blit(sprite, (0, 0), (trim_x/2, trim_y/2, offset_x, offset_y) )
 
+    if scale != 1:
+        surface = rotozoom(surface, 0, scale)
+    return surface
+
+# texto que muda a todo momento (ex: estatísticas), não vai para o cache para ele não crescer sem limite
+def render_text(text, size, font, color = (224,224,224)):
+    sprite = _compose_glyphs(sprite_key(text, size, font, 0, 0, color))
+    if sprite is None:
+        sprite = render_sprite(text, size, font, color=color)
+    return sprite
+
+# monta textos digitados pelo usuário a partir dos caracteres do atlas (fontes do menu são monoespaçadas)
+def _compose_glyphs(key):
+    text, size, font, trim_x, trim_y, color, scale = key
+    if len(text) < 2 or trim_x or trim_y or scale != 1:
+        return None
+    glyphs = []
+    for char in text:
+        glyph = _atlas.get((char, size, font, trim_x, trim_y, color, scale))
+        if glyph is None:
+            return None
+        glyphs.append(glyph)
+    surface = pygame.Surface((sum(glyph.get_width() for glyph in glyphs), max(glyph.get_height() for glyph in glyphs)), pygame.SRCALPHA)
+    surface.fill((0, 0, 0, 0))
+    x = 0
+    for glyph in glyphs:
+        surface.blit(glyph, (x, 0))
+        x += glyph.get_width()
     return surface
 
+# carrega o atlas com uma única leitura de imagem, cada sprite é um recorte (subsurface) dela
+def load_atlas(image_path, index_path):
+    if not (os.path.exists(image_path) and os.path.exists(index_path)):
+        return False
+    image = pygame.image.load(image_path).convert_alpha()
+    with open(index_path) as index_file:
+        index = json.load(index_file)
+    for entry in index["sprites"]:
+        key = sprite_key(*entry["key"])
+        _atlas[key] = image.subsurface(pygame.Rect(entry["rect"]))
+    return True
+
 def wrap_position(position, size):
     x, y = position
     w, h = size
@@ -33,9 +108,54 @@ def get_random_velocity(min_speed, max_speed):
     angle = random.randrange(0, 360)
     return Vector2(speed, 0).rotate(angle)
 
+# velocidade derivada apenas da seed, assim o cliente reconstrói o asteroide sem receber sua velocidade
+def get_seeded_velocity(seed, min_speed, max_speed, scale = 1):
+    rng = random.Random(seed)
+    speed = rng.randint(min_speed, max_speed)
+    angle = rng.randrange(0, 360)
+    velocity = Vector2(speed, 0).rotate(angle) * scale
+    return to_fixed(velocity.x), to_fixed(velocity.y)
+
+def to_fixed(value):
+    return int(round(value * FIXED_ONE))
+
+def from_fixed(value):
+    return value / FIXED_ONE
+
+# tamanho do mapa em ponto fixo, usado para dar a volta na tela
+def fixed_size(size):
+    return int(size[0]) * FIXED_ONE, int(size[1]) * FIXED_ONE
+
+# checksum do estado dos asteroides em um tick, usado pelo cliente para detectar dessincronização
+def asteroid_checksum(asteroids, tick, size):
+    states = sorted((asteroid.id, *asteroid.fixed_position_at(tick, size)) for asteroid in asteroids)
+    return zlib.crc32(repr(states).encode())
+
 def create_socket(ip_address, port, max = 1000):
     game_data_connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     game_data_connection.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     game_data_connection.bind((ip_address, port))
     game_data_connection.listen(max)
-    return game_data_connection
\ No newline at end of file
+    return game_data_connection
+
+def pack_message(obj):
+    data = pickle.dumps(obj)
+    return MESSAGE_HEADER.pack(len(data)) + data
+
+# envio bloqueante, usado pelo cliente e durante o lobby
+def send_message(connection, obj):
+    connection.sendall(pack_message(obj))
+
+# retira do buffer as mensagens completas, deixando nele apenas o início de uma mensagem incompleta
+def unpack_messages(buffer):
+    messages = []
+    offset = 0
+    while len(buffer) - offset >= MESSAGE_HEADER.size:
+        size, = MESSAGE_HEADER.unpack_from(buffer, offset)
+        end = offset + MESSAGE_HEADER.size + size
+        if len(buffer) < end:
+            break
+        messages.append(pickle.loads(buffer[offset + MESSAGE_HEADER.size:end]))
+        offset = end
+    del buffer[:offset]
+    return messages
\ No newline at end of file
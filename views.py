@@ -0,0 +1,81 @@
+# camada de renderização do cliente
+# os modelos guardam apenas estado, aqui ficam os sprites e os caches de rotação de cada tipo de entidade
+
+from pygame.math import Vector2
+from pygame.transform import rotozoom, rotate
+import util
+from models import UP, SPACESHIP_SIZE, Spaceship, Bullet, ShipState, BulletState, AsteroidState
+
+# argumentos de util.load_sprite de cada tipo, usados também para gerar o atlas (atlas.py)
+def ship_sprite_args(color):
+    return (">", SPACESHIP_SIZE, "lucidasans", SPACESHIP_SIZE/6, SPACESHIP_SIZE/5, color)
+
+def bullet_sprite_args(color):
+    return (".", SPACESHIP_SIZE, "consolas", 0, 0, color)
+
+def asteroid_sprite_args(size):
+    size_to_scale = {
+        3: 1,
+        2: 0.5,
+        1: 0.25
+    }
+
+    scale = size_to_scale[size]
+    return ("o", SPACESHIP_SIZE*15, "consolas", SPACESHIP_SIZE*10/15, SPACESHIP_SIZE*10/2.1, (224,224,224), scale)
+
+class SpriteViews:
+    ROTATION_STEP = 1 # ângulo da nave é arredondado para esse passo, em graus, para reaproveitar o cache de rotação
+
+    def __init__(self):
+        self.sprites = {} # sprites por (tipo, cor ou tamanho)
+        self.rotations = {} # naves já rotacionadas por (cor, ângulo, suavizada)
+        # qualidade da rotação, ajustada pelo FrameGovernor do cliente
+        self.rotation_step = self.ROTATION_STEP
+        self.smooth = True # rotozoom com antialiasing ou rotate simples
+        # desenho de cada tipo de entidade, tanto as do próprio cliente quanto os estados recebidos do server
+        self.renderers = {
+            Spaceship: self._draw_ship,
+            ShipState: self._draw_ship,
+            Bullet: self._draw_bullet,
+            BulletState: self._draw_bullet,
+            AsteroidState: self._draw_asteroid,
+        }
+
+    def draw(self, surface, game_objects):
+        for game_object in game_objects:
+            self.renderers[type(game_object)](surface, game_object)
+
+    def _sprite(self, key, args):
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite = util.load_sprite(*args)
+            if key[0] == "ship":
+                sprite = rotate(sprite, 90)
+            self.sprites[key] = sprite
+        return sprite
+
+    def _draw_ship(self, surface, ship):
+        angle = Vector2(ship.direction).angle_to(UP)
+        angle = round(angle / self.rotation_step) * self.rotation_step % 360
+        key = (tuple(ship.color), angle, self.smooth)
+        rotated_surface = self.rotations.get(key)
+        if rotated_surface is None:
+            sprite = self._sprite(("ship", tuple(ship.color)), ship_sprite_args(ship.color))
+            if self.smooth:
+                rotated_surface = rotozoom(sprite, angle, 1.0)
+            else:
+                rotated_surface = rotate(sprite, angle)
+            self.rotations[key] = rotated_surface
+        x, y = ship.position
+        surface.blit(rotated_surface, (x - rotated_surface.get_width() * 0.5, y - rotated_surface.get_height() * 0.5))
+
+    def _draw_bullet(self, surface, bullet):
+        self._blit(surface, self._sprite(("bullet", tuple(bullet.color)), bullet_sprite_args(bullet.color)), bullet.position)
+
+    def _draw_asteroid(self, surface, asteroid):
+        self._blit(surface, self._sprite(("asteroid", asteroid.size), asteroid_sprite_args(asteroid.size)), asteroid.position)
+
+    def _blit(self, surface, sprite, position):
+        x, y = position
+        radius = sprite.get_width() / 2
+        surface.blit(sprite, (x - radius, y - radius))